@@ -1,82 +1,906 @@
-from fastapi import FastAPI, Query
-from fastapi.responses import JSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import List
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
 import json
+import os
+import threading
+import time
 import faiss
+import numpy as np
 from sentence_transformers import SentenceTransformer
+from exact_vectors import ExactVectors, exact_vectors_count
+from facets import FacetIndex, SearchFilters
+from generation import read_generation
+from index_factory import make_search_params
+from index_meta import load_index_meta
+from lexical_index import LexicalIndex, lexical_index_path
+from query_cache import LRUCache, normalize_query
+from related_graph import RELATED_GRAPH_FILE, RelatedGraph
+from record_store import RecordStore, incident_key, is_record_store_fresh, record_lookups
+from memory_stats import process_memory
+from metrics import CONTENT_TYPE, REGISTRY
+from micro_batch import MicroBatcher
+from passages import PASSAGE_OVERFETCH, is_chunked, parent_ids, passage_ids
+from response_format import FastJSONResponse, decode_cursor, encode_cursor, parse_fields, project
+from search_snapshot import CORPUS_FILES, SNAPSHOT_FILE, SearchSnapshotFile, available_corpora, snapshot_generation
 
-app = FastAPI()
+# Reference point for time-to-first-query
+IMPORT_STARTED = time.perf_counter()
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+app = FastAPI(default_response_class=FastJSONResponse)
+# Large result pages compress very well (repeated keys, Spanish prose)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
-index_incidents = faiss.read_index("incident_index.faiss")
-index_solicitudes = faiss.read_index("solicitudes_index.faiss")
-index_causaraiz = faiss.read_index("causaraiz_index.faiss")
-index_postmortem = faiss.read_index("postmortem_index.faiss")
 
-with open("normalized_incidents.json", "r", encoding="utf-8") as f:
-    incidents = json.load(f)
+# Answered while the model and indexes are still loading
+ALWAYS_AVAILABLE = {"/health", "/metrics", "/docs", "/openapi.json"}
 
-with open("normalized_solicitudes.json", "r", encoding="utf-8") as f:
-    solicitudes = json.load(f)
 
-with open("normalized_causaraiz.json", "r", encoding="utf-8") as f:
-    causaraiz = json.load(f)
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    if not startup.ready.is_set() and request.url.path not in ALWAYS_AVAILABLE:
+        return FastJSONResponse(status_code=503, content={"detail": f"Starting up ({startup.state})"})
 
-with open("raw_postmortem.json", "r", encoding="utf-8") as f:
-    postmortem = json.load(f)
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
 
+    # The route template ("/record/{corpus}/{record_id}") keeps the label set small
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    HTTP_SECONDS.observe(elapsed, endpoint=endpoint, status=str(response.status_code))
 
-def search_faiss(query: str, index, data, num_results=100):
-    query_lower = query.strip().lower()
-    query_vector = model.encode([query]).astype("float32")
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS and endpoint != "/metrics":
+        print(f"🐢 Slow request: {elapsed * 1000:.1f}ms {request.method} {request.url.path}?{request.url.query}")
+
+    if startup.first_query_seconds is None and endpoint.startswith("/search") and response.status_code == 200:
+        startup.first_query_seconds = time.perf_counter() - IMPORT_STARTED
+        print(f"⏱️ Time to first query: {startup.first_query_seconds:.2f}s")
+
+    return response
+
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Loaded by load_resources(), together with the first snapshot
+model = None
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+# normalized query -> embedding; only depends on the model, so it survives index rebuilds
+embedding_cache = LRUCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+# (generation, normalized query, corpus, num_results, search params) -> ranked record positions
+result_cache = LRUCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+
+def env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class Corpus:
+    """A searchable corpus: its FAISS index, its records and the lookups built over them."""
+
+    def __init__(self, name, index, data, lexical=None, id_mapped=False, index_config=None, lookups=None,
+                 passage_counts=None):
+        self.name = name
+        self.index = index
+        # Full records: a list from json.load or a lazily decoding RecordStore
+        self.data = data
+        # Small per-record dicts (id, title, ...) that are always in memory
+        self.light = data.light if isinstance(data, RecordStore) else data
+        self.lexical = lexical
+        # Facet postings (date, country, status, sections) for filtered search
+        self.facets = None
+        self.index_config = index_config or {"type": "flat"}
+        # Chunked indexes hold passages; hits are aggregated back to their parent record
+        self.chunked = is_chunked(self.index_config)
+        # page id -> number of passages, to filter chunked searches by record
+        self.passage_counts = passage_counts or {}
+        # Default search-time parameters, e.g. FAISS_NPROBE_INCIDENTS=32 or FAISS_EF_SEARCH=128
+        self.nprobe = env_int(f"FAISS_NPROBE_{name.upper()}", env_int("FAISS_NPROBE"))
+        self.ef_search = env_int(f"FAISS_EF_SEARCH_{name.upper()}", env_int("FAISS_EF_SEARCH"))
+        # Candidates per wanted hit reranked by exact distance (quantized indexes with a side file; 0 = off)
+        self.rerank = env_int(f"FAISS_RERANK_{name.upper()}", env_int("FAISS_RERANK", self.index_config.get("rerank")))
+        # ExactVectors of the side file, set by the loaders when reranking is on
+        self.exact = None
+        # FAISS id -> position, and the hash indexes for /record (page id and incident number -> position);
+        # prebuilt ones come from the search snapshot file
+        self.faiss_to_pos, self.by_page_id, self.by_incident_number = lookups or record_lookups(self.light, id_mapped)
+
+    def lookup(self, record_id):
+        """Position of a record by page id or incident number ("INC-4098" == "4098"), or None."""
+        record_id = str(record_id).strip()
+        if record_id in self.by_page_id:
+            return self.by_page_id[record_id]
+        key = incident_key(record_id)
+        return self.by_incident_number.get(key) if key is not None else None
+
+    def search_k(self, num_results):
+        """How many neighbours to ask FAISS for to end up with `num_results` records."""
+        return num_results * PASSAGE_OVERFETCH if self.chunked else num_results
+
+    def candidates_k(self, search_k):
+        """How many neighbours the index returns for `search_k` results, before reranking."""
+        return search_k * self.rerank if self.exact is not None else search_k
+
+    def positions(self, faiss_ids):
+        """Maps ids returned by index.search to positions in `data`, best first."""
+        if self.chunked:
+            # A record ranks where its best passage ranks
+            faiss_ids = parent_ids(faiss_ids)
+        if self.faiss_to_pos is None:
+            return [int(i) for i in faiss_ids if i != -1 and i < len(self.data)]
+        return [self.faiss_to_pos[i] for i in map(int, faiss_ids) if i in self.faiss_to_pos]
+
+    def allowed_positions(self, filters):
+        """Positions matching the facet filters, or None when nothing is filtered."""
+        if filters is None or filters.is_empty():
+            return None
+        if self.facets is None:
+            # Without a facet index nothing can be shown to match
+            return set()
+        return self.facets.select(filters)
+
+    def faiss_selector(self, filters):
+        """IDSelector restricting index.search to the records matching the filters."""
+        allowed = self.allowed_positions(filters)
+        if allowed is None:
+            return None
+        if self.faiss_to_pos is None:
+            ids = list(allowed)
+        else:
+            ids = [int(self.light[pos]["id"]) for pos in allowed]
+        if self.chunked:
+            ids = [i for page_id in ids for i in passage_ids(page_id, self.passage_counts.get(page_id, 1))]
+        return faiss.IDSelectorBatch(np.array(ids, dtype="int64"))
+
+    def search_params(self, nprobe=None, ef_search=None, filters=None):
+        """FAISS search parameters for this index type; request values override the defaults."""
+        return make_search_params(
+            self.index_config, nprobe or self.nprobe, ef_search or self.ef_search, self.faiss_selector(filters)
+        )
+
+
+def load_lexical_index(faiss_path, data):
+    """Loads the prebuilt lexical index next to a .faiss file, if it matches the data."""
+    path = lexical_index_path(faiss_path)
+    if not os.path.exists(path):
+        print(f"⚠️ Warning: {path} not found, using substring fallback.")
+        return None
+
+    lexical = LexicalIndex.load(path)
+    if lexical.num_docs != len(data):
+        print(f"⚠️ Warning: {path} has {lexical.num_docs} records but data has {len(data)}, using substring fallback.")
+        return None
+
+    return lexical
+
+
+# With FAISS_MMAP=1 indexes are mapped read-only instead of copied into each process
+FAISS_MMAP = os.getenv("FAISS_MMAP", "0") == "1"
+FAISS_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def read_faiss_index(faiss_path):
+    return faiss.read_index(faiss_path, FAISS_MMAP_FLAGS) if FAISS_MMAP else faiss.read_index(faiss_path)
+
+
+def load_corpus(name, faiss_path, data_path):
+    index = read_faiss_index(faiss_path)
+
+    # Prefer the mmap'd record store written by vectorize_data.py / record_store.py
+    if is_record_store_fresh(data_path):
+        data = RecordStore(data_path)
+    else:
+        with open(data_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+    # Indexes written by vectorize_data.py with a meta sidecar are keyed by page id
+    meta = load_index_meta(faiss_path)
+    id_mapped = meta is not None
+    index_config = meta.get("index") if meta else None
+    passage_counts = {int(page_id): n for page_id, n in meta.get("passages", {}).items()} if meta else None
+
+    corpus = Corpus(
+        name, index, data, load_lexical_index(faiss_path, data), id_mapped, index_config, passage_counts=passage_counts
+    )
+
+    corpus.facets = FacetIndex.load(data_path, corpus.by_page_id)
+    if corpus.facets is None:
+        print(f"⚠️ Warning: no facet index for {data_path}, filtered searches return nothing.")
+    corpus.exact = load_exact_vectors(corpus, faiss_path)
+
+    return corpus
+
+
+def load_corpus_from_file(name, snapshot_file):
+    """A corpus from the prebuilt search snapshot: no JSON parsing and no lookups to rebuild."""
+    part = snapshot_file.corpora[name]
+    # A file of its own, so FAISS_MMAP shares its pages between workers like the .faiss files
+    index = read_faiss_index(snapshot_file.index_path(part))
+    offsets = snapshot_file.blob(part["offsets"], dtype="int64")
+    data = RecordStore.from_buffer(snapshot_file.mm, part["records"], offsets, part["light"])
+
+    lookups = (part["faiss_to_pos"], part["by_page_id"], part["by_incident_number"])
+    lexical = None
+    if part["lexical"] is not None:
+        lexical = LexicalIndex.from_packed(
+            part["lexical"]["rows"], snapshot_file.blob(part["lexical"]["offsets"], dtype="int64"),
+            *(snapshot_file.blob(part["lexical"][name], dtype="int32") for name in ("doc_ids", "tfs", "doc_lengths")),
+        )
+
+    corpus = Corpus(
+        name, index, data, lexical, index_config=part["index_config"], lookups=lookups,
+        passage_counts=part.get("passage_counts"),
+    )
+    corpus.facets = part["facets"]
+    corpus.exact = load_exact_vectors(corpus, CORPUS_FILES[name][0])
+    return corpus
+
+
+def load_exact_vectors(corpus, faiss_path):
+    """The mmap'd exact vectors to rerank with, if reranking is on and the side file matches the index."""
+    if not corpus.rerank:
+        return None
+    if exact_vectors_count(faiss_path) != corpus.index.ntotal:
+        print(f"⚠️ Warning: no exact vectors matching {faiss_path}, searching {corpus.name} without reranking.")
+        return None
+    return ExactVectors.load(faiss_path)
+
+
+class Snapshot:
+    """Everything a request searches, loaded for one index generation.
+
+    Requests grab the current snapshot once and use it until they finish, so a
+    reload can swap in a new one without disturbing in-flight searches.
+    """
+
+    def __init__(self, generation, corpora, related=None):
+        self.generation = generation
+        self.corpora = corpora
+        # Precomputed related records (related_graph.py), None if it was never built
+        self.related = related
+
+
+# Threads loading the corpora (1 = one after the other)
+API_LOAD_WORKERS = int(os.getenv("API_LOAD_WORKERS", str(len(CORPUS_FILES))))
+# Prebuilt snapshot written by vectorize_data.py ("" to always load the individual files)
+API_SNAPSHOT_FILE = os.getenv("API_SNAPSHOT_FILE", SNAPSHOT_FILE)
+
+
+def load_snapshot():
+    """Loads every corpus, from the prebuilt snapshot file when it matches the current generation."""
+    generation = read_generation()
+
+    if API_SNAPSHOT_FILE and snapshot_generation(API_SNAPSHOT_FILE) == generation:
+        snapshot_file = SearchSnapshotFile(API_SNAPSHOT_FILE)
+        # Corpora that had nothing to index when the snapshot was written aren't in it
+        loaders = {name: (load_corpus_from_file, name, snapshot_file) for name in CORPUS_FILES
+                   if name in snapshot_file.corpora}
+    else:
+        loaders = {name: (load_corpus, name, *files) for name, files in available_corpora().items()}
+
+    # Index reads and JSON parsing of different corpora overlap
+    with ThreadPoolExecutor(max_workers=max(1, API_LOAD_WORKERS)) as pool:
+        futures = {name: pool.submit(*loader) for name, loader in loaders.items()}
+        related_future = pool.submit(load_related_graph)
+        corpora = {name: future.result() for name, future in futures.items()}
+
+    return Snapshot(generation, corpora, related_future.result())
+
+
+def load_related_graph():
+    if not os.path.exists(RELATED_GRAPH_FILE):
+        print(f"⚠️ Warning: {RELATED_GRAPH_FILE} not found, /related is unavailable.")
+        return None
+    return RelatedGraph.load(RELATED_GRAPH_FILE)
+
+
+class Startup:
+    """Loading state reported by /health."""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.state = "loading"
+        self.error = None
+        self.timings = {}
+        self.first_query_seconds = None
+
+
+startup = Startup()
+snapshot = None
+
+
+def load_resources():
+    """Loads the model and the first snapshot in parallel; both are needed before serving."""
+    global model, snapshot
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        startup.timings[stage] = round(time.perf_counter() - start, 3)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            model_future = pool.submit(timed, "model", SentenceTransformer, MODEL_NAME)
+            snapshot_future = pool.submit(timed, "snapshot", load_snapshot)
+            model, snapshot = model_future.result(), snapshot_future.result()
+    except Exception as e:
+        startup.state, startup.error = "failed", str(e)
+        raise
+
+    startup.timings["ready"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    startup.state = "ready"
+    startup.ready.set()
+    print(f"✅ Ready in {startup.timings['ready']:.2f}s (model {startup.timings['model']:.2f}s, "
+          f"snapshot {startup.timings['snapshot']:.2f}s)")
+
+
+# With API_LAZY_START=1 the server starts accepting connections right away and
+# loads in the background, answering 503 (and /health "loading") until ready.
+# serve.py needs everything loaded before it forks, so it keeps the default.
+API_LAZY_START = os.getenv("API_LAZY_START", "0") == "1"
+if not API_LAZY_START:
+    load_resources()
+
+# FAISS releases the GIL while searching, so the corpora can be searched in parallel
+search_executor = ThreadPoolExecutor(max_workers=len(CORPUS_FILES))
+
+RELOAD_POLL_SECONDS = float(os.getenv("RELOAD_POLL_SECONDS", "10"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+reload_lock = threading.Lock()
+
+
+def reload_snapshot(force=False):
+    """Loads the indexes and records of a new generation and swaps them in atomically.
+
+    The model stays loaded; only indexes and JSON records are read again.
+    """
+    global snapshot
+    with reload_lock:
+        if not force and read_generation() == snapshot.generation:
+            return False
+
+        start = time.perf_counter()
+        new_snapshot = load_snapshot()
+        # Rebinding a global is atomic; requests holding the old snapshot finish on it
+        snapshot = new_snapshot
+        result_cache.clear()
+
+    print(f"✅ Reloaded generation {new_snapshot.generation} in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def watch_generation():
+    """Background thread: reloads whenever vectorize_data.py bumps the generation file."""
+    while True:
+        time.sleep(RELOAD_POLL_SECONDS)
+        try:
+            reload_snapshot()
+        except Exception as e:
+            # Keep serving the old snapshot if the new files are broken or half-written
+            print(f"❌ Reload failed, keeping generation {snapshot.generation}: {e}")
+
+
+def load_in_background():
+    try:
+        load_resources()
+    except Exception as e:
+        print(f"❌ Startup failed: {e}")
+        return
+    if RELOAD_POLL_SECONDS > 0:
+        watch_generation()
+
+
+@app.on_event("startup")
+def start_reload_watcher():
+    if API_LAZY_START:
+        # The watcher starts once the first snapshot is loaded
+        threading.Thread(target=load_in_background, name="startup-loader", daemon=True).start()
+    elif RELOAD_POLL_SECONDS > 0:
+        threading.Thread(target=watch_generation, name="reload-watcher", daemon=True).start()
+
+
+# Concurrent requests are coalesced into one model.encode / index.search call each
+MICRO_BATCH = os.getenv("MICRO_BATCH", "1") == "1"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "32"))
+MICRO_BATCH_WAIT_MS = float(os.getenv("MICRO_BATCH_WAIT_MS", "1"))
+
+
+def batch_encode(queries):
+    vectors = model.encode(queries, batch_size=len(queries)).astype("float32")
+    return [vector[None, :] for vector in vectors]
+
+
+def batch_search(items):
+    """Searches (corpus, query_vector, k, nprobe, ef_search, filters) items with one index.search per group.
+
+    A group whose search fails gets the exception as its results, so the
+    other requests in the batch still succeed.
+    """
+    groups = {}
+    for pos, (corpus, _, _, nprobe, ef_search, filters) in enumerate(items):
+        groups.setdefault((id(corpus), nprobe, ef_search, filters), []).append(pos)
+
+    results = [None] * len(items)
+    for positions in groups.values():
+        corpus, _, _, nprobe, ef_search, filters = items[positions[0]]
+        vectors = np.vstack([items[pos][1] for pos in positions])
+        k = max(items[pos][2] for pos in positions)
+
+        try:
+            _, idx = corpus.index.search(vectors, k, params=corpus.search_params(nprobe, ef_search, filters))
+        except Exception as e:
+            for pos in positions:
+                results[pos] = e
+            continue
+
+        for pos, row in zip(positions, idx):
+            results[pos] = row[:items[pos][2]]
 
-    _, idx = index.search(query_vector, num_results)
+    return results
 
-    faiss_matches = [data[i] for i in idx[0] if i != -1 and i < len(data)]
 
-    filtered_matches = [
-        record for record in faiss_matches
-        if query_lower in record.get("title", "").lower()
-        or query_lower in record.get("content", "").lower()
-        or query_lower in record.get("número del incidente", "").lower()
-    ]
+encode_batcher = MicroBatcher(batch_encode, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WAIT_MS, "encode-batcher")
+# One batcher per corpus so the corpora are still searched in parallel
+search_batchers = {
+    name: MicroBatcher(batch_search, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WAIT_MS, f"search-batcher-{name}")
+    for name in CORPUS_FILES
+}
 
-    if not filtered_matches:
-        filtered_matches = [
-            record for record in data
-            if query_lower in record.get("número del incidente", "").lower()
+
+# Search latency is logged with its stage breakdown above this many milliseconds (0 = off)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+SEARCH_STAGE_SECONDS = REGISTRY.histogram(
+    "search_stage_seconds", "Time per search stage (encode, search, rerank, filter, sort) on result cache misses",
+    ["corpus", "stage"],
+)
+SEARCH_SECONDS = REGISTRY.histogram("search_seconds", "Time to rank one corpus for a query", ["corpus", "cached"])
+FALLBACK_SCANS = REGISTRY.counter(
+    "search_fallback_total", "Searches where no FAISS hit matched and the corpus was scanned instead",
+    ["corpus", "kind"],
+)
+FALLBACK_SCANNED = REGISTRY.counter(
+    "search_fallback_records_scanned_total", "Records examined by fallback scans", ["corpus", "kind"]
+)
+HTTP_SECONDS = REGISTRY.histogram("http_request_seconds", "Endpoint handler latency", ["endpoint", "status"])
+
+
+def cache_metric(field):
+    caches = {"embedding": embedding_cache, "result": result_cache}
+    return lambda: {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+
+REGISTRY.gauge("query_cache_entries", "Entries in the in-process caches", cache_metric("size"), ["cache"])
+REGISTRY.gauge("query_cache_hits_total", "Cache hits", cache_metric("hits"), ["cache"], kind="counter")
+REGISTRY.gauge("query_cache_misses_total", "Cache misses", cache_metric("misses"), ["cache"], kind="counter")
+
+
+def loaded_corpora():
+    return snapshot.corpora if snapshot is not None else {}
+
+
+REGISTRY.gauge("api_ready", "1 once the model and indexes are loaded", lambda: {(): int(startup.ready.is_set())})
+REGISTRY.gauge(
+    "index_generation", "Index generation being served",
+    lambda: {(): snapshot.generation} if snapshot is not None else {},
+)
+REGISTRY.gauge(
+    "index_vectors", "Vectors in each FAISS index",
+    lambda: {(name, corpus.index_config["type"]): corpus.index.ntotal for name, corpus in loaded_corpora().items()},
+    ["corpus", "type"],
+)
+REGISTRY.gauge(
+    "corpus_records", "Records served per corpus",
+    lambda: {(name,): len(corpus.data) for name, corpus in loaded_corpora().items()}, ["corpus"],
+)
+REGISTRY.gauge(
+    "micro_batch_items_total", "Items coalesced by each micro-batcher",
+    lambda: {(batcher.name,): batcher.items for batcher in [encode_batcher, *search_batchers.values()]},
+    ["batcher"], kind="counter",
+)
+REGISTRY.gauge(
+    "micro_batch_batches_total", "Batches run by each micro-batcher",
+    lambda: {(batcher.name,): batcher.batches for batcher in [encode_batcher, *search_batchers.values()]},
+    ["batcher"], kind="counter",
+)
+
+
+def encode_query(query: str):
+    key = normalize_query(query)
+    query_vector = embedding_cache.get(key)
+    if query_vector is None:
+        if MICRO_BATCH:
+            query_vector = encode_batcher.submit(key)
+        else:
+            query_vector = model.encode([key]).astype("float32")
+        embedding_cache.put(key, query_vector)
+    return query_vector
+
+
+def search_index(corpus, query_vector, num_results, nprobe=None, ef_search=None, filters=None):
+    """Returns the FAISS ids of the nearest neighbours of one query vector among the filtered records."""
+    if MICRO_BATCH:
+        return search_batchers[corpus.name].submit((corpus, query_vector, num_results, nprobe, ef_search, filters))
+
+    params = corpus.search_params(nprobe, ef_search, filters)
+    _, idx = corpus.index.search(query_vector, num_results, params=params)
+    return idx[0]
+
+
+def rank_faiss(query: str, corpus, num_results=100, query_vector=None, nprobe=None, ef_search=None, filters=None,
+               timings=None):
+    """Returns (position in `corpus.data`, lexical score) of the best matches, best first.
+
+    With a `timings` dict, the seconds spent in each stage (encode, search,
+    rerank, filter, sort) are added to it.
+    """
+    started = time.perf_counter()
+
+    def lap(stage):
+        nonlocal started
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + now - started
+            started = now
+
+    allowed = corpus.allowed_positions(filters)
+    lap("filter")
+    if allowed is not None and not allowed:
+        return []
+
+    if query_vector is None:
+        query_vector = encode_query(query)
+    lap("encode")
+
+    faiss_hits = search_index(
+        corpus, query_vector, corpus.candidates_k(corpus.search_k(num_results)), nprobe, ef_search, filters
+    )
+    lap("search")
+
+    return rank_candidates(query, corpus, query_vector, faiss_hits, num_results, allowed, lap)
+
+
+def rank_candidates(query: str, corpus, query_vector, faiss_hits, num_results=100, allowed=None, lap=None):
+    """Ranks the FAISS ids returned for one query: exact rerank, parent records, then lexical scores.
+
+    Split from rank_faiss so callers that search many queries in one
+    index.search call (search_incident.py) rank exactly like the API.
+    """
+    lap = lap or (lambda stage: None)
+
+    if corpus.exact is not None:
+        # Quantized distances only pick the candidates; exact distances order them
+        faiss_hits = corpus.exact.rerank(query_vector, faiss_hits, corpus.search_k(num_results))
+        lap("rerank")
+    faiss_ids = corpus.positions(faiss_hits)[:num_results]
+
+    lexical = corpus.lexical
+    if lexical is None:
+        hits = substring_search(query, corpus.data, faiss_ids, num_results, allowed, corpus.name)
+        lap("filter")
+        return hits
+
+    # BM25 scores only for docs that contain every query token
+    scores = lexical.score(query)
+    if allowed is not None:
+        scores = {i: score for i, score in scores.items() if i in allowed}
+
+    filtered_ids = [i for i in faiss_ids if i in scores]
+    lap("filter")
+
+    if not filtered_ids:
+        FALLBACK_SCANS.inc(corpus=corpus.name, kind="lexical")
+        FALLBACK_SCANNED.inc(len(scores), corpus=corpus.name, kind="lexical")
+        filtered_ids = sorted(scores, key=scores.get, reverse=True)[:num_results]
+
+    filtered_ids.sort(key=scores.get, reverse=True)
+    lap("sort")
+
+    return [(i, scores[i]) for i in filtered_ids[:num_results]]
+
+
+def search_faiss(query: str, corpus, num_results=100, query_vector=None, nprobe=None, ef_search=None, filters=None,
+                 timings=None):
+    hits = rank_faiss(query, corpus, num_results, query_vector, nprobe, ef_search, filters, timings)
+    return [corpus.data[i] for i, _ in hits]
+
+
+def ranked_corpus(corpus: str, query: str, num_results=100, query_vector=None, nprobe=None, ef_search=None,
+                  snap=None, filters=None):
+    """Cached ranked (position, score) hits over one corpus of a snapshot (the current one by default).
+
+    The cached list is the stable result set that cursors page through.
+    """
+    snap = snap or snapshot
+    query = normalize_query(query)
+
+    start = time.perf_counter()
+    key = (snap.generation, query, corpus, num_results, nprobe, ef_search, filters)
+    hits = result_cache.get(key)
+    if hits is not None:
+        SEARCH_SECONDS.observe(time.perf_counter() - start, corpus=corpus, cached="true")
+        return hits
+
+    timings = {}
+    hits = rank_faiss(query, snap.corpora[corpus], num_results, query_vector, nprobe, ef_search, filters, timings)
+    result_cache.put(key, hits)
+
+    elapsed = time.perf_counter() - start
+    SEARCH_SECONDS.observe(elapsed, corpus=corpus, cached="false")
+    for stage, seconds in timings.items():
+        SEARCH_STAGE_SECONDS.observe(seconds, corpus=corpus, stage=stage)
+
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        stages = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+        print(f"🐢 Slow search in {corpus}: {elapsed * 1000:.1f}ms ({stages}) query={query!r} filters={filters}")
+
+    return hits
+
+
+def substring_search(query: str, data, faiss_ids, num_results=100, allowed=None, corpus_name=""):
+    """Legacy full-corpus substring filter, used when no lexical index is available."""
+    query_lower = query.strip().lower()
+
+    def matches(record):
+        return (
+            query_lower in record.get("número del incidente", "").lower()
             or query_lower in record.get("title", "").lower()
             or query_lower in record.get("content", "").lower()
-        ]
+        )
 
-    def rank_result(record):
-        content = (record.get("title", "") + " " + record.get("content", "")).lower()
+    filtered_ids = [i for i in faiss_ids if matches(data[i])]
+
+    if not filtered_ids:
+        candidates = range(len(data)) if allowed is None else sorted(allowed)
+        FALLBACK_SCANS.inc(corpus=corpus_name, kind="substring")
+        FALLBACK_SCANNED.inc(len(candidates), corpus=corpus_name, kind="substring")
+        filtered_ids = [i for i in candidates if matches(data[i])]
+
+    def rank_result(i):
+        content = (data[i].get("title", "") + " " + data[i].get("content", "")).lower()
         return content.count(query_lower)
 
-    filtered_matches.sort(key=rank_result, reverse=True)
+    scores = {i: rank_result(i) for i in filtered_ids}
+    filtered_ids.sort(key=scores.get, reverse=True)
+
+    return [(i, scores[i]) for i in filtered_ids[:num_results]]
 
-    return filtered_matches[:num_results]
+
+def best_matches(corpus: str, query: str, num_results: int, fields):
+    """Response body of the single-corpus endpoints, projected to `fields` when given."""
+    snap = snapshot
+    data = get_corpus(corpus, snap).data
+    fields = parse_fields(fields)
+    hits = ranked_corpus(corpus, query, num_results, snap=snap)
+    return {"query": query, "best_matches": [project(data[i], fields, query, score) for i, score in hits]}
 
 
 @app.get("/search_incident")
-def search_incident(query: str = Query(..., title="Incident Query"), num_results: int = 100):
-    results = search_faiss(query, index_incidents, incidents, num_results)
-    return JSONResponse(content={"query": query, "best_matches": results}, media_type="application/json")
+def search_incident(query: str = Query(..., title="Incident Query"), num_results: int = Query(100, gt=0), fields: List[str] = Query(None)):
+    return best_matches("incidents", query, num_results, fields)
 
 
 @app.get("/search_solicitudes")
-def search_solicitudes(query: str = Query(..., title="Solicitudes Query"), num_results: int = 100):
-    results = search_faiss(query, index_solicitudes, solicitudes, num_results)
-    return JSONResponse(content={"query": query, "best_matches": results}, media_type="application/json")
+def search_solicitudes(query: str = Query(..., title="Solicitudes Query"), num_results: int = Query(100, gt=0), fields: List[str] = Query(None)):
+    return best_matches("solicitudes", query, num_results, fields)
 
 
 @app.get("/search_causaraiz")
-def search_causaraiz(query: str = Query(..., title="Causa Raíz Query"), num_results: int = 100):
-    results = search_faiss(query, index_causaraiz, causaraiz, num_results)
-    return JSONResponse(content={"query": query, "best_matches": results}, media_type="application/json")
+def search_causaraiz(query: str = Query(..., title="Causa Raíz Query"), num_results: int = Query(100, gt=0), fields: List[str] = Query(None)):
+    return best_matches("causaraiz", query, num_results, fields)
 
 
 @app.get("/search_postmortem")
-def search_postmortem(query: str = Query(..., title="Postmortem Query"), num_results: int = 100):
-    results = search_faiss(query, index_postmortem, postmortem, num_results)
-    return JSONResponse(content={"query": query, "best_matches": results}, media_type="application/json")
+def search_postmortem(query: str = Query(..., title="Postmortem Query"), num_results: int = Query(100, gt=0), fields: List[str] = Query(None)):
+    return best_matches("postmortem", query, num_results, fields)
+
+
+def query_date(value, name):
+    """A YYYY-MM-DD query parameter as the string the facet index compares against; 400 if malformed."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected YYYY-MM-DD")
+
+
+@app.get("/search")
+def search_all(
+    query: str = Query(..., title="Search Query"),
+    categories: List[str] = Query(None, title="Categories to search (default: all)"),
+    num_results: int = Query(100, gt=0, title="Hits per category"),
+    nprobe: int = Query(None, title="IVF lists to probe (IVF indexes only)"),
+    ef_search: int = Query(None, title="HNSW search depth (HNSW indexes only)"),
+    date_from: str = Query(None, title="Created on or after (YYYY-MM-DD)"),
+    date_to: str = Query(None, title="Created on or before (YYYY-MM-DD)"),
+    country: List[str] = Query(None, title="Country named in the title (any of)"),
+    status: List[str] = Query(None, title="Causa raíz status (any of)"),
+    has_section: List[str] = Query(None, title="Extracted sections the record must have (all of)"),
+    fields: List[str] = Query(None, title="Fields to return, e.g. id,title,score,snippet (default: all)"),
+    page_size: int = Query(None, gt=0, title="Hits per category per page (default: all num_results)"),
+    cursor: str = Query(None, title="next_cursor of the previous page"),
+):
+    snap = snapshot
+    categories = categories or list(snap.corpora)
+    unknown = [c for c in categories if c not in snap.corpora]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown categories: {', '.join(unknown)}")
+
+    offset = 0
+    if cursor:
+        try:
+            generation, offset = decode_cursor(cursor)
+            if offset < 0:
+                raise ValueError(offset)
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if generation != snap.generation:
+            # The ranked result set a cursor points into is gone after a reload
+            raise HTTPException(status_code=410, detail="Cursor expired, the indexes were reloaded")
+
+    fields = parse_fields(fields)
+    page_size = page_size or num_results
+
+    filters = SearchFilters(
+        query_date(date_from, "date_from"), query_date(date_to, "date_to"),
+        tuple(country or ()), tuple(status or ()), tuple(has_section or ()),
+    )
+
+    # Encode once and reuse the vector for every selected corpus
+    query_vector = encode_query(query)
+
+    futures = {}
+    for category in categories:
+        futures[category] = search_executor.submit(
+            ranked_corpus, category, query, num_results, query_vector, nprobe, ef_search, snap, filters
+        )
+
+    results = {}
+    totals = {}
+    for category, future in futures.items():
+        hits = future.result()
+        data = snap.corpora[category].data
+        # Only the hits on this page are decoded and projected
+        results[category] = [project(data[i], fields, query, score) for i, score in hits[offset:offset + page_size]]
+        totals[category] = len(hits)
+
+    next_offset = offset + page_size
+    next_cursor = encode_cursor(snap.generation, next_offset) if any(t > next_offset for t in totals.values()) else None
+
+    return {"query": query, "results": results, "total": totals, "next_cursor": next_cursor}
+
+
+@app.get("/cache_stats")
+def cache_stats():
+    return {
+        "generation": snapshot.generation,
+        "embedding_cache": embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "micro_batch": {
+            "enabled": MICRO_BATCH,
+            "encode": encode_batcher.stats(),
+            "search": {name: batcher.stats() for name, batcher in search_batchers.items()},
+        },
+    }
+
+
+@app.get("/health")
+def health():
+    """Readiness: 200 once queries can be answered, 503 while loading or after a failed start."""
+    body = {
+        "status": startup.state,
+        "generation": snapshot.generation if snapshot is not None else None,
+        "load_seconds": startup.timings,
+        "time_to_first_query_seconds": startup.first_query_seconds,
+    }
+    if startup.error:
+        body["error"] = startup.error
+    return FastJSONResponse(status_code=200 if startup.ready.is_set() else 503, content=body)
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format; every worker process of serve.py reports its own values."""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.post("/admin/reload")
+def admin_reload(force: bool = False, x_admin_token: str = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    try:
+        reloaded = reload_snapshot(force=force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+
+    return {"reloaded": reloaded, "generation": snapshot.generation}
+
+
+@app.get("/memory")
+def memory():
+    """Resident vs shared memory of the worker answering this request."""
+    return {"pid": os.getpid(), **process_memory()}
+
+
+def get_corpus(corpus: str, snap=None):
+    snap = snap or snapshot
+    if corpus not in snap.corpora:
+        raise HTTPException(status_code=404, detail=f"Unknown corpus: {corpus}")
+    return snap.corpora[corpus]
+
+
+@app.get("/record/{corpus}/{record_id}")
+def get_record(corpus: str, record_id: str, fields: List[str] = Query(None, title="Fields to return (default: all)")):
+    """One record by Confluence page id or incident number, without any search."""
+    selected = get_corpus(corpus)
+    pos = selected.lookup(record_id)
+    if pos is None:
+        raise HTTPException(status_code=404, detail=f"Record {record_id} not found in {corpus}")
+    return project(selected.data[pos], parse_fields(fields))
+
+
+@app.get("/records/{corpus}")
+def get_records(
+    corpus: str,
+    ids: List[str] = Query(..., title="Page ids or incident numbers"),
+    fields: List[str] = Query(None, title="Fields to return (default: all)"),
+):
+    """Batch lookup; ids that don't exist map to null."""
+    selected = get_corpus(corpus)
+    fields = parse_fields(fields)
+    records = {}
+    for record_id in ids:
+        pos = selected.lookup(record_id)
+        records[record_id] = project(selected.data[pos], fields) if pos is not None else None
+    return {"records": records}
+
+
+@app.get("/related/{corpus}/{record_id}")
+def get_related(
+    corpus: str,
+    record_id: str,
+    categories: List[str] = Query(None, title="Corpora to take related records from (default: all)"),
+    num_results: int = Query(None, gt=0, title="Related records per corpus (default: all precomputed)"),
+    fields: List[str] = Query(None, title="Fields to return, e.g. id,title,score (default: id,title,score)"),
+):
+    """Records most similar to one record, per corpus, from the precomputed graph: no encode, no search."""
+    snap = snapshot
+    selected = get_corpus(corpus, snap)
+    pos = selected.lookup(record_id)
+    if pos is None:
+        raise HTTPException(status_code=404, detail=f"Record {record_id} not found in {corpus}")
+    if snap.related is None:
+        raise HTTPException(status_code=503, detail="Related records graph not built")
+
+    categories = categories or list(snap.corpora)
+    unknown = [c for c in categories if c not in snap.corpora]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown categories: {', '.join(unknown)}")
+
+    page_id = selected.light[pos].get("id")
+    related = snap.related.related(corpus, page_id, categories, num_results) if page_id else None
+    if related is None:
+        # Records without content have no vector, so no neighbours either
+        related = {category: [] for category in categories}
+
+    fields = parse_fields(fields or ["id,title,score"])
+    results = {}
+    for category in categories:
+        target = snap.corpora[category]
+        results[category] = []
+        # A corpus that had no vectors when the graph was built has no neighbours in it
+        for neighbour_id, score in related.get(category, []):
+            neighbour_pos = target.lookup(neighbour_id)
+            if neighbour_pos is not None:
+                results[category].append(project(target.data[neighbour_pos], fields, score=score))
+
+    return {"corpus": corpus, "id": str(page_id), "related": results}
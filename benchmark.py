@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import requests
+from loadtest import API_QUERY_CACHE_SIZE, percentile, query_cycle, run_load
+from normalize_data import JsonArrayWriter, clean_text, extract_incident_sections, iter_json_array
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SIZES = [10_000, 100_000, 1_000_000]
+STAGES = ["extract", "vectorize", "search", "startup", "http"]
+# Stages that talk to a separate API server process
+SERVER_STAGES = {"startup", "http"}
+
+# The other corpora only need to exist so api.py can load a full snapshot
+SIDE_CORPUS_SIZE = 1_000
+
+WORDS = [
+    "error", "cuota", "pagaré", "cuenta", "cancelada", "débito", "automático", "cartera", "activación",
+    "reprocesamiento", "cliente", "préstamo", "saldo", "abono", "transferencia", "tarjeta", "crédito",
+    "factura", "interés", "mora", "sucursal", "usuario", "sistema", "reporte", "batch", "proceso",
+    "pago", "referencia", "contrato", "desembolso", "validación", "servicio", "timeout", "conexión",
+    "base", "datos", "tabla", "registro", "duplicado", "pendiente", "rechazado", "aplicado", "cierre",
+    "diario", "mensual", "archivo", "carga", "integración", "banco", "moneda", "tipo", "cambio",
+]
+COUNTRIES = ["México", "Costa Rica", "El Salvador", "Guatemala", "Honduras", "Nicaragua", "Panamá"]
+TOPICS = ["Consulta Pagaré", "Error en cuota", "Separar cuentas", "Débito automático", "Cuenta cancelada"]
+TEXT_SECTIONS = ["descripción del problema", "análisis y acciones tomadas", "solución aplicada", "causa raíz"]
+TABLES = ["PRESTAMOS", "CUOTAS", "CLIENTES", "PAGOS", "CUENTAS"]
+FIRST_DATE = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+def sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_record(rng, i):
+    """One record in the shape of normalized_*.json, with labelled content to extract sections from."""
+    sections = {}
+    for field in TEXT_SECTIONS:
+        if rng.random() < 0.8:
+            sections[field] = " ".join(sentence(rng) for _ in range(rng.randint(1, 3)))
+    if rng.random() < 0.3:
+        sections["query"] = (
+            f"SELECT * FROM {rng.choice(TABLES)}\nWHERE ID_PRESTAMO = {rng.randint(1, 10 ** 6)}\n"
+            f"AND ESTADO = '{rng.choice(['A', 'C', 'P'])}';"
+        )
+
+    number = 4000 + i
+    created = FIRST_DATE + timedelta(seconds=rng.randint(0, 4 * 365 * 86400))
+    content = "\n".join(f"{field.capitalize()}:\n{value}" for field, value in sections.items())
+
+    return {
+        "id": str(10_000_000 + i),
+        "title": f"INC-{number} {rng.choice(COUNTRIES)} R-{rng.randint(10000, 99999)} - {rng.choice(TOPICS)}",
+        "created": created.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "content": f"Número del incidente: INC-{number}\n{content}",
+        "número del incidente": f"INC-{number}",
+        **{field: value if field == "query" else clean_text(value) for field, value in sections.items()},
+    }
+
+
+def generate_corpus(path, size, seed=0):
+    """Streams `size` synthetic records to `path` (skipped when it already exists)."""
+    if os.path.exists(path):
+        return
+    rng = random.Random(seed)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        writer = JsonArrayWriter(f)
+        for i in range(size):
+            writer.write(synthetic_record(rng, i))
+        writer.close()
+    os.replace(path + ".tmp", path)
+    print(f"✅ Generated {size} records in '{path}'")
+
+
+def synthetic_queries(count, seed=1):
+    rng = random.Random(seed)
+    # Distinct queries so no request is answered from the API caches
+    return list(dict.fromkeys(" ".join(rng.sample(WORDS, rng.randint(1, 3))) for _ in range(count * 2)))[:count]
+
+
+def summarize(seconds):
+    """Latency summary in milliseconds of a list of durations in seconds."""
+    values = sorted(seconds)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return round(time.perf_counter() - start, 3)
+
+
+def bench_extract(json_path):
+    contents = [record["content"] for record in iter_json_array(json_path)]
+    start = time.perf_counter()
+    for content in contents:
+        extract_incident_sections(content, verbose=False)
+    elapsed = time.perf_counter() - start
+    return {"records": len(contents), "seconds": round(elapsed, 3), "records_per_second": round(len(contents) / elapsed, 1)}
+
+
+def bench_vectorize():
+    """Times create_vector_store cold, as a no-op re-run and rebuilt from cached embeddings."""
+    import vectorize_data
+    from generation import read_generation
+    from index_meta import index_meta_path
+    from lexical_index import build_lexical_index, lexical_index_path
+    from record_store import convert_json_to_record_store
+    from search_snapshot import write_search_snapshot
+
+    report = {}
+    for json_file, faiss_file in vectorize_data.DATASETS.items():
+        if json_file != "normalized_incidents.json":
+            # Side corpora are built but not measured
+            vectorize_data.create_vector_store(json_file, faiss_file)
+            build_lexical_index(json_file, lexical_index_path(faiss_file))
+            convert_json_to_record_store(json_file)
+            continue
+
+        report["cold_seconds"] = timed(vectorize_data.create_vector_store, json_file, faiss_file)
+        report["noop_seconds"] = timed(vectorize_data.create_vector_store, json_file, faiss_file)
+        os.remove(index_meta_path(faiss_file))
+        report["cached_rebuild_seconds"] = timed(vectorize_data.create_vector_store, json_file, faiss_file)
+        report["lexical_index_seconds"] = timed(build_lexical_index, json_file, lexical_index_path(faiss_file))
+        report["record_store_seconds"] = timed(convert_json_to_record_store, json_file)
+
+    report["search_snapshot_seconds"] = timed(write_search_snapshot, read_generation())
+    return report
+
+
+def bench_search(num_queries, num_results):
+    """Per-stage latency of api.search_faiss (encode, search, filter, sort), one query at a time."""
+    import api
+    # Straight calls, so each stage is measured on its own rather than inside a micro-batch
+    api.MICRO_BATCH = False
+    corpus = api.snapshot.corpora["incidents"]
+
+    queries = synthetic_queries(num_queries + 10)
+    for query in queries[:10]:
+        api.search_faiss(query, corpus, num_results)
+
+    stages = {}
+    totals = []
+    for query in queries[10:]:
+        timings = {}
+        start = time.perf_counter()
+        api.search_faiss(query, corpus, num_results, timings=timings)
+        totals.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    return {
+        "num_results": num_results,
+        "total": summarize(totals),
+        **{stage: summarize(seconds) for stage, seconds in stages.items()},
+    }
+
+
+def start_api(workdir, port, **env):
+    """Starts uvicorn on the synthetic corpora in `workdir`; returns (process, base url)."""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, RELOAD_POLL_SECONDS="0", **env)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+def wait_for(server, url, params=None, interval=0.05):
+    """Polls `url` until it answers 200; returns the seconds it took."""
+    start = time.perf_counter()
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        try:
+            if requests.get(url, params=params, timeout=5).status_code == 200:
+                return time.perf_counter() - start
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(interval)
+
+
+# Startup variants: the old sequential load of every file, the parallel one, and the prebuilt snapshot
+STARTUP_VARIANTS = {
+    "sequential_files": {"API_LOAD_WORKERS": "1", "API_SNAPSHOT_FILE": ""},
+    "parallel_files": {"API_SNAPSHOT_FILE": ""},
+    "snapshot_file": {},
+}
+
+
+def bench_startup(workdir, port):
+    """Time-to-first-query: from spawning the server to the first successful /search."""
+    report = {}
+    for variant, env in STARTUP_VARIANTS.items():
+        server, base_url = start_api(workdir, port, **env)
+        try:
+            seconds = wait_for(server, base_url + "/search", {"query": "error en cuota", "num_results": 10})
+            health = requests.get(base_url + "/health", timeout=5).json()
+        finally:
+            server.terminate()
+            server.wait()
+        report[variant] = {"time_to_first_query_seconds": round(seconds, 3), "load_seconds": health["load_seconds"]}
+    return report
+
+
+def bench_http(workdir, port, concurrency, duration, num_results):
+    """Starts the API on the synthetic corpora and load-tests /search with uncached queries."""
+    server, base_url = start_api(workdir, port)
+    try:
+        wait_for(server, base_url + "/health", interval=1)
+        # Taken in order and more than the API caches hold, so no request is served from them
+        next_query = query_cycle(synthetic_queries(4 * API_QUERY_CACHE_SIZE))
+
+        def params_for(rng):
+            return {"query": next_query(), "num_results": num_results}
+
+        return [run_load(base_url + "/search", params_for, c, duration) for c in concurrency]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_worker(args):
+    """Runs the in-process stages for one corpus size inside its work directory."""
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_DIR)
+    stages = args.stages.split(",")
+
+    report = {}
+    if "extract" in stages:
+        report["extract"] = bench_extract("normalized_incidents.json")
+    if "vectorize" in stages:
+        report["vectorize"] = bench_vectorize()
+    if "search" in stages:
+        report["search"] = bench_search(args.queries, args.num_results)
+
+    with open("worker_result.json", "w", encoding="utf-8") as f:
+        json.dump(report, f)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(report, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, numbers only, for comparing two runs."""
+    flat = {}
+    items = enumerate(report) if isinstance(report, list) else report.items()
+    for key, value in items:
+        name = f"{prefix}{key}"
+        if isinstance(value, (dict, list)):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline_path, report):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = flatten(json.load(f)["sizes"])
+    current = flatten(report["sizes"])
+    print(f"📊 Compared with {baseline_path}:")
+    for name in sorted(set(baseline) & set(current)):
+        if baseline[name]:
+            change = (current[name] - baseline[name]) / baseline[name] * 100
+            print(f"   {name:<55} {baseline[name]:>12} → {current[name]:>12}  ({change:+.1f}%)")
+
+
+def main(args):
+    stages = args.stages.split(",")
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "sizes": {},
+    }
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        workdir = os.path.abspath(os.path.join(args.data_dir, str(size)))
+        os.makedirs(workdir, exist_ok=True)
+
+        # Same file names as production, so api.py and vectorize_data.py run unchanged in `workdir`
+        generate_corpus(os.path.join(workdir, "normalized_incidents.json"), size)
+        for i, json_file in enumerate(["normalized_solicitudes.json", "normalized_causaraiz.json",
+                                       "normalized_postmortem.json"]):
+            generate_corpus(os.path.join(workdir, json_file), min(size, SIDE_CORPUS_SIZE), seed=i + 1)
+
+        # Each size runs in its own process: api.py loads its snapshot from the working directory at import
+        worker_stages = [stage for stage in stages if stage not in SERVER_STAGES]
+        size_report = {}
+        if worker_stages:
+            subprocess.run([
+                sys.executable, os.path.abspath(__file__), "--worker", "--workdir", workdir,
+                "--stages", ",".join(worker_stages), "--queries", str(args.queries),
+                "--num-results", str(args.num_results),
+            ], check=True)
+            with open(os.path.join(workdir, "worker_result.json"), "r", encoding="utf-8") as f:
+                size_report = json.load(f)
+
+        if "startup" in stages:
+            size_report["startup"] = bench_startup(workdir, args.port)
+        if "http" in stages:
+            concurrency = [int(c) for c in args.concurrency.split(",")]
+            size_report["http"] = bench_http(workdir, args.port, concurrency, args.duration, args.num_results)
+
+        report["sizes"][str(size)] = size_report
+        print(f"✅ {size} records:\n{json.dumps(size_report, indent=4)}")
+
+    output = args.output or f"benchmark_{(report['commit'] or 'local')[:10]}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"✅ Results saved to {output}")
+
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the ingest and search stages on synthetic corpora.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Comma-separated corpus sizes")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--data-dir", default="bench_data", help="Where synthetic corpora and their indexes go")
+    parser.add_argument("--queries", type=int, default=200, help="Queries timed by the search stage")
+    parser.add_argument("--num-results", type=int, default=100)
+    parser.add_argument("--concurrency", default="1,4,16", help="Concurrency levels of the HTTP load test")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="JSON results file (default: benchmark_<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to print relative changes against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+    else:
+        main(args)
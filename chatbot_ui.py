@@ -1,5 +1,7 @@
 import streamlit as st
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
 
 st.set_page_config(page_title="Chatbot de Incidentes", page_icon="💬", layout="wide")
 
@@ -13,13 +15,30 @@ filter_options = st.multiselect(
     default=[]
 )
 
+country_filter = st.multiselect(
+    "🌎 Filtrar por país (opcional):",
+    options=["México", "Costa Rica", "El Salvador", "Guatemala", "Honduras", "Nicaragua", "Panamá"],
+    default=[]
+)
+
+# Label -> days back from today (None = no date filter)
+periods = {"Todos": None, "Últimos 30 días": 30, "Últimos 6 meses": 182, "Último año": 365}
+period = st.selectbox("📅 Periodo:", options=list(periods.keys()))
+
 API_BASE_URL = "http://127.0.0.1:8000"
 
-endpoints = {
-    "incidents": "/search_incident",
-    "solicitudes": "/search_solicitudes",
-    "causaraiz": "/search_causaraiz",
-    "postmortem": "/search_postmortem",
+# Hits rendered per category before "Cargar más"; the API ranks up to NUM_RESULTS
+PAGE_SIZE = 20
+NUM_RESULTS = 100
+# Searches kept in the session, oldest dropped first
+MAX_CACHED_SEARCHES = 20
+
+# UI filter label -> category name used by the /search endpoint
+categories = {
+    "incidentes": "incidents",
+    "solicitudes": "solicitudes",
+    "causaraiz": "causaraiz",
+    "postmortem": "postmortem",
 }
 
 # Define SQL-related keywords
@@ -30,59 +49,180 @@ code_keywords = [
     "procedimiento ejecutado", "query usado", "consulta utilizada", "ejemplo de query", "script sql"
 ]
 
+def fetch_record(category, record_id):
+    """Full record for an expander, fetched once and kept for the session."""
+    key = (category, record_id)
+    if key not in st.session_state.records:
+        response = requests.get(f"{API_BASE_URL}/record/{category}/{record_id}", timeout=10)
+        response.raise_for_status()
+        st.session_state.records[key] = response.json()
+    return st.session_state.records[key]
+
+
+def show_record(record):
+    for key, value in record.items():
+        if value:  # Ensure there's data to display
+            formatted_key = key.replace("_", " ").capitalize()
+
+            # Check if the key is an SQL-related field
+            if any(keyword.lower() in key.lower() for keyword in code_keywords):
+                st.markdown(f"### 💻 {formatted_key}")
+                st.code(value, language="sql")  # Display as SQL code
+            else:
+                st.markdown(f"### 📝 {formatted_key}")
+                st.write(value)
+
+
+def fetch_page(params, category, cursor=None):
+    """One page of hits for one category: {"results": [...], "total": n, "next_cursor": ...}."""
+    page_params = dict(params, categories=[category], page_size=PAGE_SIZE)
+    if cursor:
+        page_params["cursor"] = cursor
+    response = requests.get(API_BASE_URL + "/search", params=page_params, timeout=10)
+    response.raise_for_status()
+    page = response.json()
+    return {
+        "results": page["results"].get(category, []),
+        "total": page["total"].get(category, 0),
+        "next_cursor": page.get("next_cursor"),
+    }
+
+
+def load_more(search_key, filter_type):
+    """Appends the next page of a category to the cached search (button callback)."""
+    params, pages = st.session_state.searches[search_key]
+    page = pages[filter_type]
+    try:
+        next_page = fetch_page(params, categories[filter_type], page["next_cursor"])
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 410:
+            # The indexes were reloaded; the cached pages belong to the old ones
+            del st.session_state.searches[search_key]
+            st.session_state.notice = "♻️ Los índices se actualizaron, vuelve a buscar."
+            return
+        page["error"] = str(e)
+        return
+    except requests.exceptions.RequestException as e:
+        page["error"] = str(e)
+        return
+    page["results"].extend(next_page["results"])
+    page["next_cursor"] = next_page["next_cursor"]
+    page.pop("error", None)
+
+
+def show_category(search_key, filter_type, page):
+    category = categories[filter_type]
+    results = page["results"]
+
+    if not results:
+        st.warning(f"❌ No se encontraron resultados en {filter_type.capitalize()}.")
+        return
+
+    st.success(f"✅ {page['total']} resultados en {filter_type.capitalize()} (mostrando {len(results)})")
+
+    for i, result in enumerate(results):
+        expander_title = f"📌 {filter_type.capitalize()} #{i+1}: {result.get('title', 'Sin título')}"
+
+        with st.expander(expander_title):
+            incident_id = result.get("id", "unknown")
+            st.markdown(f"💎 **ID:** `{incident_id}`", unsafe_allow_html=True)
+
+            # Expander bodies are built on every rerun, so the full record is only fetched on demand
+            if (category, incident_id) in st.session_state.records:
+                show_record(st.session_state.records[(category, incident_id)])
+            else:
+                st.write(result.get("snippet", ""))
+                if st.button("📄 Ver registro completo", key=f"full-{category}-{incident_id}"):
+                    try:
+                        show_record(fetch_record(category, incident_id))
+                    except requests.exceptions.RequestException as e:
+                        st.error(f"🚨 Error en la solicitud a la API: {e}")
+
+            # Construct Confluence link
+            confluence_url = f"https://akros.atlassian.net/wiki/spaces/ET/pages/{incident_id}"
+
+            # External hyperlink to Confluence
+            st.markdown(
+                f'<a href="{confluence_url}" target="_blank">'
+                f'📄 <b>Ver detalles en Confluence</b>'
+                f'</a>',
+                unsafe_allow_html=True
+            )
+
+    if page.get("error"):
+        st.error(f"🚨 Error en la solicitud a la API: {page['error']}")
+    if page["next_cursor"]:
+        st.button(
+            "⬇️ Cargar más", key=f"more-{category}", on_click=load_more, args=(search_key, filter_type)
+        )
+
+
+# Streamlit reruns the script on every click, so searches and opened records live in the session.
+# searches: (query, categories, countries, date_from) -> (request params, {filter: pages loaded so far})
+st.session_state.setdefault("search", None)
+st.session_state.setdefault("searches", {})
+st.session_state.setdefault("records", {})
+st.session_state.setdefault("notice", None)
+
 if st.button("Buscar Incidente 🔎"):
     if query.strip():
-        selected_filters = filter_options or endpoints.keys()
-
-        for filter_type in selected_filters:
-            url = API_BASE_URL + endpoints[filter_type]
-
-            with st.spinner(f"🔄 Buscando en {filter_type.capitalize()}..."):
-                try:
-                    params = {"query": query.strip().lower(), "num_results": 100}
-                    response = requests.get(url, params=params, timeout=10)
-
-                    if response.status_code == 200:
-                        results = response.json().get("best_matches", [])
-
-                        if results:
-                            st.success(f"✅ {len(results)} resultados en {filter_type.capitalize()}")
-
-                            for i, result in enumerate(results):
-                                expander_title = f"📌 {filter_type.capitalize()} #{i+1}: {result.get('title', 'Sin título')}"
-
-                                with st.expander(expander_title):
-                                    st.markdown(f"💎 **ID:** `{result.get('id', 'Desconocido')}`", unsafe_allow_html=True)
-
-                                    for key, value in result.items():
-                                        if value:  # Ensure there's data to display
-                                            formatted_key = key.replace("_", " ").capitalize()
-
-                                            # Check if the key is an SQL-related field
-                                            if any(keyword.lower() in key.lower() for keyword in code_keywords):
-                                                st.markdown(f"### 💻 {formatted_key}")
-                                                st.code(value, language="sql")  # Display as SQL code
-                                            else:
-                                                st.markdown(f"### 📝 {formatted_key}")
-                                                st.write(value)
-
-                                    # Construct Confluence link
-                                    incident_id = result.get("id", "unknown")
-                                    incident_title = result.get("title", "Sin título")
-                                    confluence_url = f"https://akros.atlassian.net/wiki/spaces/ET/pages/{incident_id}"
-
-                                    # External hyperlink to Confluence
-                                    st.markdown(
-                                        f'<a href="{confluence_url}" target="_blank">'
-                                        f'📄 <b>Ver detalles en Confluence</b>'
-                                        f'</a>',
-                                        unsafe_allow_html=True
-                                    )
-
-                        else:
-                            st.warning(f"❌ No se encontraron resultados en {filter_type.capitalize()}.")
-
-                except requests.exceptions.RequestException as e:
-                    st.error(f"🚨 Error en la solicitud a la API ({filter_type.capitalize()}): {e}")
+        selected_filters = filter_options or list(categories.keys())
+        date_from = (date.today() - timedelta(days=periods[period])).isoformat() if periods[period] else None
+        search_key = (query.strip().lower(), tuple(selected_filters), tuple(country_filter), date_from)
+
+        if search_key not in st.session_state.searches:
+            params = {
+                "query": search_key[0],
+                "num_results": NUM_RESULTS,
+                "country": country_filter,
+                # Summaries only; full records are fetched when asked for
+                "fields": "id,title,score,snippet",
+            }
+            # Filters are applied inside the vector search, before the top results are cut
+            if date_from:
+                params["date_from"] = date_from
+            st.session_state.searches[search_key] = (params, {})
+            while len(st.session_state.searches) > MAX_CACHED_SEARCHES:
+                del st.session_state.searches[next(iter(st.session_state.searches))]
+
+        st.session_state.search = search_key
     else:
         st.warning("⚠️ Por favor, ingresa una consulta antes de buscar.")
+
+if st.session_state.notice:
+    st.info(st.session_state.notice)
+    st.session_state.notice = None
+
+if st.session_state.search in st.session_state.searches:
+    search_key = st.session_state.search
+    params, pages = st.session_state.searches[search_key]
+    selected_filters = search_key[1]
+
+    # One slot per category, in the selected order, filled as its results arrive
+    slots = {filter_type: st.container() for filter_type in selected_filters}
+    pending = [filter_type for filter_type in selected_filters if filter_type not in pages]
+
+    for filter_type in selected_filters:
+        if filter_type in pages:
+            with slots[filter_type]:
+                show_category(search_key, filter_type, pages[filter_type])
+
+    if pending:
+        spinners = {filter_type: slots[filter_type].empty() for filter_type in pending}
+        for filter_type, spinner in spinners.items():
+            spinner.info(f"🔄 Buscando en {filter_type.capitalize()}...")
+
+        # Categories are searched concurrently; each is rendered as soon as its first page is back
+        with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+            futures = {pool.submit(fetch_page, params, categories[f]): f for f in pending}
+            for future in as_completed(futures):
+                filter_type = futures[future]
+                spinners[filter_type].empty()
+                with slots[filter_type]:
+                    try:
+                        pages[filter_type] = future.result()
+                    except requests.exceptions.RequestException as e:
+                        # Not cached, so the next rerun tries this category again
+                        st.error(f"🚨 Error en la solicitud a la API ({filter_type}): {e}")
+                        continue
+                    show_category(search_key, filter_type, pages[filter_type])
@@ -0,0 +1,74 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent (model name, content hash) -> embedding store backed by SQLite."""
+
+    def __init__(self, path=EMBEDDING_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self.conn.commit()
+
+    def get_many(self, model_name, hashes):
+        """Returns {hash: vector} for the hashes already in the cache."""
+        found = {}
+        hashes = list(set(hashes))
+        with self.lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model_name, *chunk],
+                )
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def put_many(self, model_name, items):
+        """Stores an iterable of (hash, vector) pairs."""
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model_name, h, np.asarray(v, dtype="float32").tobytes()) for h, v in items],
+            )
+            self.conn.commit()
+
+    def encode(self, model, model_name, texts, batch_size=64, verbose=True):
+        """Embeds texts, only running the model on texts not seen before."""
+        hashes = [content_hash(text) for text in texts]
+        cached = self.get_many(model_name, hashes)
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = text
+
+        if missing:
+            vectors = model.encode(list(missing.values()), batch_size=batch_size)
+            new_items = list(zip(missing.keys(), np.asarray(vectors, dtype="float32")))
+            self.put_many(model_name, new_items)
+            cached.update(new_items)
+
+        if verbose:
+            print(f"🔍 Debug: {len(texts)} texts, {len(texts) - len(missing)} from embedding cache, {len(missing)} encoded")
+
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        return np.stack([cached[h] for h in hashes]).astype("float32")
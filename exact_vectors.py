@@ -0,0 +1,115 @@
+import os
+import numpy as np
+
+# Rows copied per step when rewriting the side file
+COPY_ROWS = 65536
+
+
+def exact_vectors_paths(faiss_path):
+    """x_index.faiss -> (x_index.vectors.npy, x_index.ids.npy): float32 vectors and their FAISS ids."""
+    base = faiss_path.rsplit(".faiss", 1)[0]
+    return base + ".vectors.npy", base + ".ids.npy"
+
+
+def exact_vectors_count(faiss_path):
+    """Rows in the side file of an index, or None if it has none."""
+    vectors_path, ids_path = exact_vectors_paths(faiss_path)
+    if not (os.path.exists(vectors_path) and os.path.exists(ids_path)):
+        return None
+    return len(np.load(ids_path, mmap_mode="r"))
+
+
+class ExactVectors:
+    """Full-precision vectors of a quantized index, used to rerank its candidates.
+
+    Loaded from disk the vectors are mmap'd, so API workers share them through
+    the page cache and only the rows of reranked candidates are ever read.
+    """
+
+    def __init__(self, vectors, ids):
+        self.vectors = vectors
+        # Sorted ids and their rows, for vectorized id -> row lookups
+        self.order = np.argsort(ids, kind="stable")
+        self.sorted_ids = np.asarray(ids)[self.order]
+
+    @classmethod
+    def load(cls, faiss_path):
+        vectors_path, ids_path = exact_vectors_paths(faiss_path)
+        return cls(np.load(vectors_path, mmap_mode="r"), np.load(ids_path))
+
+    def rerank(self, query_vector, faiss_ids, k):
+        """The k candidates closest to the query by exact L2 distance, best first."""
+        faiss_ids = np.asarray(faiss_ids, dtype="int64")
+        faiss_ids = faiss_ids[faiss_ids != -1]
+        if not len(self.sorted_ids) or not len(faiss_ids):
+            return faiss_ids[:k]
+
+        slots = np.minimum(np.searchsorted(self.sorted_ids, faiss_ids), len(self.sorted_ids) - 1)
+        known = self.sorted_ids[slots] == faiss_ids
+        candidates = faiss_ids[known]
+        vectors = self.vectors[self.order[slots[known]]]
+
+        distances = ((vectors - np.asarray(query_vector, dtype="float32").reshape(1, -1)) ** 2).sum(axis=1)
+        return candidates[np.argsort(distances, kind="stable")[:k]]
+
+    def nbytes(self):
+        return self.vectors.nbytes + self.sorted_ids.nbytes + self.order.nbytes
+
+
+class ExactVectorWriter:
+    """Rewrites the side file of an index as it is updated.
+
+    Rows of the previous file are kept unless their id was removed; vectors
+    added in this run are spooled to a temporary file as they come, so memory
+    doesn't grow with the corpus.
+    """
+
+    def __init__(self, faiss_path, dim, removed_ids=(), rebuild=False):
+        self.vectors_path, self.ids_path = exact_vectors_paths(faiss_path)
+        self.dim = dim
+        self.previous = None if rebuild or exact_vectors_count(faiss_path) is None else ExactVectors.load(faiss_path)
+        self.removed = np.asarray(list(removed_ids), dtype="int64")
+        self.spool_path = self.vectors_path + ".spool"
+        self.spool = open(self.spool_path, "wb")
+        self.new_ids = []
+
+    def add(self, vectors, ids):
+        self.spool.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+        self.new_ids.extend(int(i) for i in ids)
+
+    def finish(self):
+        self.spool.close()
+        try:
+            if self.previous is not None:
+                old_ids = self.previous.sorted_ids
+                old_rows = self.previous.order[~np.isin(old_ids, self.removed)]
+                old_ids = old_ids[~np.isin(old_ids, self.removed)]
+            else:
+                old_ids = old_rows = np.zeros(0, dtype="int64")
+
+            total = len(old_ids) + len(self.new_ids)
+            vectors_tmp = self.vectors_path + ".tmp"
+            out = np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype="float32", shape=(total, self.dim))
+            for start in range(0, len(old_rows), COPY_ROWS):
+                rows = old_rows[start:start + COPY_ROWS]
+                out[start:start + len(rows)] = self.previous.vectors[rows]
+            if self.new_ids:
+                spooled = np.memmap(self.spool_path, dtype="float32", mode="r", shape=(len(self.new_ids), self.dim))
+                for start in range(0, len(spooled), COPY_ROWS):
+                    rows = spooled[start:start + COPY_ROWS]
+                    out[len(old_ids) + start:len(old_ids) + start + len(rows)] = rows
+                del spooled
+            out.flush()
+            del out
+
+            ids_tmp = self.ids_path + ".tmp"
+            with open(ids_tmp, "wb") as f:
+                np.save(f, np.concatenate([old_ids, np.array(self.new_ids, dtype="int64")]))
+
+            # The ids go last: a side file whose row count doesn't match its index is rebuilt
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(ids_tmp, self.ids_path)
+        finally:
+            os.remove(self.spool_path)
+
+        print(f"✅ Exact vectors for reranking saved as '{self.vectors_path}' ({total} vectors)")
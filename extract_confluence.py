@@ -1,8 +1,16 @@
 import os
+import random
 import requests
 import json
+import threading
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from storage_parser import parse_storage
 import time
 
 # Load environment variables
@@ -11,101 +19,289 @@ ATLASSIAN_DOMAIN = os.getenv("ATLASSIAN_DOMAIN")
 ATLASSIAN_EMAIL = os.getenv("ATLASSIAN_EMAIL")
 ATLASSIAN_API_TOKEN = os.getenv("ATLASSIAN_API_TOKEN")
 
+# Override to point the crawler at another server (e.g. a local fake Confluence for tests)
+CONFLUENCE_BASE_URL = os.getenv("CONFLUENCE_BASE_URL") or f"https://{ATLASSIAN_DOMAIN}/wiki"
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))
+CRAWL_MAX_RETRIES = int(os.getenv("CRAWL_MAX_RETRIES", "5"))
+CRAWL_MIN_INTERVAL = float(os.getenv("CRAWL_MIN_INTERVAL", "0.05"))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "30"))
+# CQL `lastmodified` is evaluated in the server's timezone at minute resolution, so the
+# cursor is moved back by this much; re-fetching a page twice is harmless
+SYNC_OVERLAP_MINUTES = int(os.getenv("SYNC_OVERLAP_MINUTES", "1440"))
+# "structured": one pass over the storage XHTML yields the text and the field sections;
+# "soup": plain text only via BeautifulSoup, sections are left to normalize_data.py's regexes
+EXTRACT_MODE = os.getenv("EXTRACT_MODE", "structured")
+
 auth = (ATLASSIAN_EMAIL, ATLASSIAN_API_TOKEN)
 headers = {"Accept": "application/json"}
 
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Spaces out requests across threads and backs off when the server answers 429."""
+
+    def __init__(self, min_interval=CRAWL_MIN_INTERVAL, max_interval=5.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def throttled(self, retry_after=None):
+        """Server asked us to slow down: double the spacing and pause everyone."""
+        with self.lock:
+            self.interval = min(max(self.interval * 2, self.min_interval or 0.05), self.max_interval)
+            if retry_after:
+                self.next_slot = max(self.next_slot, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        """Slowly speed back up after successful calls."""
+        with self.lock:
+            self.interval = max(self.interval * 0.9, self.min_interval)
+
+
+def parse_retry_after(value):
+    """Retry-After can be a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
+def create_session(pool_size=CRAWL_CONCURRENCY):
+    """One pooled HTTP session shared by every crawler thread."""
+    session = requests.Session()
+    session.auth = auth
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = create_session()
+rate_limiter = RateLimiter()
+
+
+def get_with_retries(url, params=None):
+    """GET with adaptive rate limiting, Retry-After support and exponential backoff."""
+    for attempt in range(CRAWL_MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        try:
+            response = session.get(url, params=params, timeout=CRAWL_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            if attempt == CRAWL_MAX_RETRIES:
+                raise
+            print(f"⚠️ Connection error on {url} ({e}), retrying...")
+            time.sleep(min(2 ** attempt, 30) + random.random())
+            continue
+
+        if response.status_code not in RETRYABLE_STATUS or attempt == CRAWL_MAX_RETRIES:
+            if response.status_code == 200:
+                rate_limiter.succeeded()
+            return response
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 429:
+            rate_limiter.throttled(retry_after)
+        time.sleep(retry_after if retry_after is not None else min(2 ** attempt, 30) + random.random())
+
+    return response
+
 # File to track last fetched timestamp
 LAST_FETCH_FILE = "last_fetch.json"
 
-def load_last_fetch_time():
-    """Loads the timestamp of the last fetched incident."""
+def load_fetch_cursors():
+    """Loads the per-category sync cursors from last_fetch.json."""
     try:
         with open(LAST_FETCH_FILE, "r") as file:
-            data = json.load(file)
-            return data.get("last_fetch_time", None)
+            return json.load(file).get("categories", {})
     except (FileNotFoundError, json.JSONDecodeError):
-        return None
-
-def save_last_fetch_time(timestamp):
-    """Saves the timestamp of the latest fetched incident."""
-    with open(LAST_FETCH_FILE, "w") as file:
-        json.dump({"last_fetch_time": timestamp}, file)
-
-def get_child_pages(parent_id, start=0, limit=50):
-    """Fetch ALL child pages for a given parent ID, including nested pages."""
-    all_pages = []
-    
-    while True:
-        url = f"https://{ATLASSIAN_DOMAIN}/wiki/rest/api/content/{parent_id}/child/page?start={start}&limit={limit}&expand=history"
-        response = requests.get(url, headers=headers, auth=auth)
-
-        if response.status_code == 200:
-            data = response.json()
-            child_pages = data.get("results", [])
-
-            for page in child_pages:
-                created_at = page.get("history", {}).get("createdDate", "Unknown")
-                all_pages.append({
-                    "id": page["id"],
-                    "title": page["title"],
-                    "created": created_at
-                })
-
-            if len(child_pages) < limit:
-                break
-
-            start += limit
-            time.sleep(0.5)
-        else:
-            print(f"❌ Error fetching child pages: {response.status_code} - {response.text}")
-            break
-
-    return all_pages
-
-def get_page_content(page_id):
-    """Fetch the content of a single page by ID with error handling."""
-    url = f"https://{ATLASSIAN_DOMAIN}/wiki/rest/api/content/{page_id}?expand=body.storage,history"
-    response = requests.get(url, headers=headers, auth=auth)
-
-    if response.status_code == 200:
-        page = response.json()
-        
-        # Extract page content
-        content = BeautifulSoup(page["body"]["storage"]["value"], "html.parser").get_text() if "body" in page and "storage" in page["body"] else "No content found"
-        
-        # Extract created timestamp
-        created_at = page.get("history", {}).get("createdDate", "Unknown")
-
-        return {
-            "id": page_id,
+        return {}
+
+def load_last_fetch_time(category):
+    """Loads the time of the last successful sync of a category."""
+    return load_fetch_cursors().get(category, {}).get("last_fetch_time")
+
+# Categories may be synced from parallel threads (update_pipeline.py)
+fetch_cursor_lock = threading.Lock()
+
+def save_last_fetch_time(category, timestamp):
+    """Saves the time of the last successful sync of a category, keeping the others."""
+    with fetch_cursor_lock:
+        cursors = load_fetch_cursors()
+        cursors[category] = {"last_fetch_time": timestamp}
+        with open(LAST_FETCH_FILE, "w") as file:
+            json.dump({"categories": cursors}, file, indent=4)
+
+def get_all_results(url, params):
+    """Every result of a paged REST listing, following `_links.next` until there is none.
+
+    The server may return fewer results per page than asked for, so a short
+    page doesn't mean the listing is over. Raises RuntimeError on any error.
+    """
+    results = []
+    while url:
+        response = get_with_retries(url, params=params)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} failed: {response.status_code} - {response.text}")
+
+        data = response.json()
+        results.extend(data.get("results", []))
+
+        # The next link is relative to the context path and already carries the query
+        next_link = data.get("_links", {}).get("next")
+        url = CONFLUENCE_BASE_URL + next_link if next_link else None
+        params = None
+
+    return results
+
+def get_child_pages(parent_id, limit=50):
+    """Fetch ALL direct child pages of a parent ID; raises RuntimeError if the listing fails."""
+    url = f"{CONFLUENCE_BASE_URL}/rest/api/content/{parent_id}/child/page"
+    child_pages = get_all_results(url, {"start": 0, "limit": limit, "expand": "history"})
+
+    return [
+        {
+            "id": page["id"],
             "title": page["title"],
-            "content": content,
-            "created": created_at
+            "created": page.get("history", {}).get("createdDate", "Unknown"),
         }
+        for page in child_pages
+    ]
+
+def page_to_record(page):
+    """Converts a Confluence content object (with body.storage and history) to our record format."""
+    sections = None
+    if "body" not in page or "storage" not in page["body"]:
+        content = "No content found"
+    elif EXTRACT_MODE == "structured":
+        content, sections = parse_storage(page["body"]["storage"]["value"])
     else:
-        print(f"❌ Error fetching page content: {response.status_code} - {response.text}")
-        return None
+        content = BeautifulSoup(page["body"]["storage"]["value"], "html.parser").get_text()
 
-def fetch_all_pages_recursively(parent_id):
-    """Recursively fetch ALL pages and subpages under a parent folder."""
-    all_pages = []
-    child_pages = get_child_pages(parent_id)
+    # Extract created timestamp
+    created_at = page.get("history", {}).get("createdDate", "Unknown")
 
-    for child in child_pages:
-        print(f"📄 Fetching Page: {child['title']} (ID: {child['id']})")
-
-        # Fetch page content
-        page_data = get_page_content(child["id"])
-        if page_data:
-            all_pages.append(page_data)
+    record = {
+        "id": page["id"],
+        "title": page["title"],
+        "content": content,
+        "created": created_at
+    }
+    if sections:
+        record["sections"] = sections
+    return record
+
+def search_cql(cql, expand=None, limit=50):
+    """Runs a CQL content search and returns every result across all result pages."""
+    params = {"cql": cql, "start": 0, "limit": limit}
+    if expand:
+        params["expand"] = expand
+    return get_all_results(f"{CONFLUENCE_BASE_URL}/rest/api/content/search", params)
+
+def format_cql_date(timestamp):
+    """ISO timestamp -> CQL date, moved back by SYNC_OVERLAP_MINUTES."""
+    moment = datetime.fromisoformat(timestamp) - timedelta(minutes=SYNC_OVERLAP_MINUTES)
+    return moment.strftime("%Y-%m-%d %H:%M")
+
+def fetch_changes_since(parent_id, since):
+    """Returns (changed pages, ids of every page still under the folder) since a cursor.
+
+    The ids are None when the listing looks incomplete, so no deletions are applied.
+    """
+    changed = search_cql(
+        f'ancestor = {parent_id} and type = page and lastmodified >= "{format_cql_date(since)}"',
+        expand="body.storage,history",
+    )
+    # Ids only (no body) so deleted pages can be detected cheaply
+    current_ids = {page["id"] for page in search_cql(f"ancestor = {parent_id} and type = page", limit=200)}
+
+    for page in changed:
+        print(f"📄 Changed Page: {page['title']} (ID: {page['id']})")
+
+    # Pages changed moments ago must be in the listing; if one isn't, the listing missed pages
+    missing = [page["id"] for page in changed if page["id"] not in current_ids]
+    if missing:
+        print(f"⚠️ Warning: {len(missing)} changed pages are missing from the page listing, not deleting anything.")
+        current_ids = None
+
+    return [page_to_record(page) for page in changed], current_ids
 
-        # ✅ Recursively fetch subpages (Months & Incidents inside each Year)
-        sub_pages = fetch_all_pages_recursively(child["id"])
-        all_pages.extend(sub_pages)
+def get_page_content(page_id):
+    """Fetch the content of a single page by ID; raises RuntimeError if it can't be fetched."""
+    url = f"{CONFLUENCE_BASE_URL}/rest/api/content/{page_id}"
+    response = get_with_retries(url, params={"expand": "body.storage,history"})
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Error fetching page {page_id}: {response.status_code} - {response.text}")
+    return page_to_record(response.json())
+
+def fetch_all_pages_recursively(parent_id, concurrency=CRAWL_CONCURRENCY):
+    """Fetch ALL pages and subpages under a parent folder.
+
+    Sibling pages and child listings are fetched in parallel on a bounded thread
+    pool; the result keeps the same depth-first order as a sequential crawl.
+
+    Returns (pages, ids of every page listed under the folder, failures). Each
+    failure is a (kind, page id, error) tuple; a listing or page that failed is
+    missing from the result, so the crawl is only complete without failures.
+    """
+    children = {}
+    pages = {}
+    failures = []
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {executor.submit(get_child_pages, parent_id): ("children", parent_id)}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                kind, page_id = pending.pop(future)
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ {e}")
+                    failures.append((kind, page_id, str(e)))
+                    continue
+
+                if kind == "page":
+                    pages[page_id] = result
+                    continue
+
+                children[page_id] = result
+                for child in children[page_id]:
+                    print(f"📄 Fetching Page: {child['title']} (ID: {child['id']})")
+                    pending[executor.submit(get_page_content, child["id"])] = ("page", child["id"])
+                    # ✅ Subpages (Months & Incidents inside each Year) are listed in parallel too
+                    pending[executor.submit(get_child_pages, child["id"])] = ("children", child["id"])
 
-        time.sleep(0.3)
+    all_pages = []
+    stack = list(reversed(children.get(parent_id, [])))
+    while stack:
+        child = stack.pop()
+        if pages.get(child["id"]):
+            all_pages.append(pages[child["id"]])
+        stack.extend(reversed(children.get(child["id"], [])))
 
-    return all_pages
+    listed_ids = {child["id"] for listing in children.values() for child in listing}
+    return all_pages, listed_ids, failures
 
 def load_existing_data(file_path):
     """Load existing incidents from JSON file, or return empty list if not found."""
@@ -115,63 +311,104 @@ def load_existing_data(file_path):
     except (FileNotFoundError, json.JSONDecodeError):
         return []
 
-def save_new_incidents(file_path, new_incidents):
-    """Save incidents to JSON, ensuring no duplicates and only the newest data."""
-    
-    # Load existing data
+def merge_changes(file_path, changed_pages, current_ids=None):
+    """Merges changed pages into a *_prenorm.json file.
+
+    Changed pages replace their old version in place, new pages are appended and,
+    when `current_ids` is given, pages that no longer exist are dropped. The file
+    is left untouched when nothing changed.
+    """
     existing_data = load_existing_data(file_path)
-    
-    # Combine old and new incidents
-    all_incidents = existing_data + new_incidents  
+    changed_by_id = {page["id"]: page for page in changed_pages}
 
-    # ✅ Remove duplicates: Keep only incidents that have "created" timestamp
-    filtered_incidents = {}
-    for incident in all_incidents:
+    merged = []
+    seen = set()
+    updated = deleted = 0
+    for incident in existing_data:
         incident_id = incident.get("id")
+        if not incident_id or incident_id in seen:
+            continue
+        seen.add(incident_id)
+
+        if current_ids is not None and incident_id not in current_ids:
+            deleted += 1
+        elif incident_id in changed_by_id:
+            if changed_by_id[incident_id] != incident:
+                updated += 1
+            merged.append(changed_by_id[incident_id])
+        else:
+            merged.append(incident)
 
-        # If an incident has no timestamp, ignore it
-        if incident_id:
-            if incident_id not in filtered_incidents or (incident.get("created") and not filtered_incidents[incident_id].get("created")):
-                filtered_incidents[incident_id] = incident
-
-    # Convert dictionary back to list
-    final_incidents = list(filtered_incidents.values())
+    added = [page for page_id, page in changed_by_id.items() if page_id not in seen]
+    merged.extend(added)
 
-    # Save cleaned data
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(final_incidents, f, indent=4, ensure_ascii=False)
+    if not (updated or deleted or added) and os.path.exists(file_path):
+        print(f"✅ No changes for {file_path}")
+        return False
 
-    print(f"✅ {len(final_incidents)} cleaned incidents saved to {file_path}")
+    # Write to a temp file first so readers never see a half-written file
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(merged, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, file_path)
 
-if __name__ == "__main__":
-    folders = {
-        "INCIDENTES": ("9251782664", "incidentes_prenorm.json"),
-        "SOLICITUDES": ("9293692929", "solicitudes_prenorm.json"),
-        "POSTMORTEM": ("9293955073", "postmortem_prenorm.json"),
-        "CAUSA RAIZ": ("9293856769", "causaraiz_prenorm.json"),
-    }
-
-    for category, (folder_id, output_file) in folders.items():
-        print(f"\n🔍 Fetching ALL {category} incidents...")
-        all_data = fetch_all_pages_recursively(folder_id)
+    print(f"✅ {file_path}: {len(added)} added, {updated} updated, {deleted} deleted ({len(merged)} total)")
+    return True
 
-        if all_data:
-            print(f"✅ Fetch complete! Saving {len(all_data)} {category} incidents to {output_file}...")
+# Category -> (Confluence parent page id, output file)
+FOLDERS = {
+    "INCIDENTES": ("9251782664", "incidentes_prenorm.json"),
+    "SOLICITUDES": ("9293692929", "solicitudes_prenorm.json"),
+    "POSTMORTEM": ("9293955073", "postmortem_prenorm.json"),
+    "CAUSA RAIZ": ("9293856769", "causaraiz_prenorm.json"),
+}
 
-            # ✅ Ensure JSON file is always updated correctly
-            save_new_incidents(output_file, all_data)
+def sync_category(category, full_sync=False):
+    """Brings one category's *_prenorm.json up to date; returns True if the file changed."""
+    folder_id, output_file = FOLDERS[category]
 
-            # ✅ Save last fetch time
-            latest_timestamp = max([p["created"] for p in all_data if p["created"] != "Unknown"])
-            save_last_fetch_time(latest_timestamp)
-            
-            print(f"✅ {len(all_data)} {category} incidents saved in {output_file}")
+    # Cursor is taken before fetching so nothing modified during the run is missed
+    sync_started = datetime.now(timezone.utc).isoformat()
+    last_fetch_time = load_last_fetch_time(category)
 
-        else:
-            print(f"✅ No incidents found in {category}. Creating empty JSON file.")
+    if full_sync or not last_fetch_time or not os.path.exists(output_file):
+        print(f"\n🔍 Fetching ALL {category} incidents...")
+        all_data, listed_ids, failures = fetch_all_pages_recursively(folder_id)
+        print(f"✅ Fetch complete! {len(all_data)} {category} incidents found.")
+        # Pages deleted upstream are only dropped when every listing came back
+        changed = merge_changes(output_file, all_data, current_ids=None if failures else listed_ids)
+        complete = not failures
+    else:
+        print(f"\n🔍 Fetching {category} changes since {last_fetch_time}...")
+        changed_pages, current_ids = fetch_changes_since(folder_id, last_fetch_time)
+        changed = merge_changes(output_file, changed_pages, current_ids=current_ids)
+        failures = []
+        complete = current_ids is not None
+
+    if not complete:
+        # Keep the old cursor so the next run fetches whatever was missed this time
+        print(f"⚠️ {category} sync incomplete ({len(failures)} failed requests), sync cursor not advanced.")
+        for kind, page_id, error in failures:
+            print(f"   {kind} {page_id}: {error}")
+        return changed
+
+    # ✅ Save per-category sync cursor
+    save_last_fetch_time(category, sync_started)
+    return changed
 
-        # ✅ If the file doesn't exist yet, create an empty one
-        if not os.path.exists(output_file):
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump([], f, indent=4, ensure_ascii=False)
-            print(f"🆕 Created empty file: {output_file}")
\ No newline at end of file
+if __name__ == "__main__":
+    # `--full` forces a complete re-crawl instead of a delta sync
+    full_sync = "--full" in sys.argv[1:]
+
+    failed = []
+    for category in FOLDERS:
+        try:
+            sync_category(category, full_sync)
+        except (RuntimeError, requests.exceptions.RequestException) as e:
+            # One category's API errors shouldn't keep the others from syncing
+            print(f"❌ {category} sync failed: {e}")
+            failed.append(category)
+
+    if failed:
+        print(f"❌ Sync failed for {', '.join(failed)}; their cursors were not advanced.")
+        sys.exit(1)
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple, Optional, Tuple
+from lexical_index import fold_text
+
+# Folded name as it appears in titles -> canonical country name
+COUNTRIES = {
+    "mexico": "México",
+    "costa rica": "Costa Rica",
+    "el salvador": "El Salvador",
+    "guatemala": "Guatemala",
+    "honduras": "Honduras",
+    "nicaragua": "Nicaragua",
+    "panama": "Panamá",
+    "colombia": "Colombia",
+    "peru": "Perú",
+    "ecuador": "Ecuador",
+    "chile": "Chile",
+    "republica dominicana": "República Dominicana",
+}
+
+COUNTRY_RE = re.compile(r"\b(" + "|".join(re.escape(name) for name in COUNTRIES) + r")\b")
+
+# Keys of a normalized record that are not extracted sections
+BASE_FIELDS = {"id", "title", "created", "content", "status", "sections"}
+
+
+def facets_path(json_path):
+    """normalized_x.json -> normalized_x.facets.json"""
+    return json_path.rsplit(".json", 1)[0] + ".facets.json"
+
+
+def parse_country(title):
+    """Canonical country named in a title, e.g. 'INC-4157 Costa Rica R-82145 ...' -> 'Costa Rica'."""
+    match = COUNTRY_RE.search(fold_text(title))
+    return COUNTRIES[match.group(1)] if match else None
+
+
+class SearchFilters(NamedTuple):
+    """Facet filters of a search; hashable so it can be part of cache and batch keys."""
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    countries: Tuple[str, ...] = ()
+    statuses: Tuple[str, ...] = ()
+    sections: Tuple[str, ...] = ()
+
+    def is_empty(self):
+        return not any(self)
+
+
+class FacetIndexBuilder:
+    """Collects facet values of normalized records as they are written."""
+
+    def __init__(self):
+        self.created = []
+        self.country = {}
+        self.status = {}
+        self.section = {}
+
+    def add(self, record):
+        page_id = str(record["id"])
+
+        created = record.get("created", "")
+        if created and created != "Unknown":
+            self.created.append((created[:10], page_id))
+
+        country = parse_country(record.get("title", ""))
+        if country:
+            self.country.setdefault(country, []).append(page_id)
+
+        if record.get("status"):
+            self.status.setdefault(record["status"], []).append(page_id)
+
+        for field, value in record.items():
+            if field not in BASE_FIELDS and value:
+                self.section.setdefault(field, []).append(page_id)
+
+    def save(self, path):
+        self.created.sort()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": self.created,
+                "country": self.country,
+                "status": self.status,
+                "section": self.section,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        print(f"✅ Facets saved as '{path}'")
+
+
+class FacetIndex:
+    """Facet postings resolved to record positions of one corpus."""
+
+    def __init__(self, data, position_of):
+        # Dates stay sorted so a range is two bisects
+        created = [(date, position_of[page_id]) for date, page_id in data["created"] if page_id in position_of]
+        self.created_dates = [date for date, _ in created]
+        self.created_positions = [pos for _, pos in created]
+
+        def resolve(postings):
+            return {
+                value: frozenset(position_of[page_id] for page_id in page_ids if page_id in position_of)
+                for value, page_ids in postings.items()
+            }
+
+        self.country = resolve(data["country"])
+        # Countries are matched accent- and case-insensitively
+        self.country_by_folded = {fold_text(name): name for name in self.country}
+        self.status = resolve(data["status"])
+        self.section = resolve(data["section"])
+
+    @classmethod
+    def load(cls, json_path, position_of):
+        path = facets_path(json_path)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), position_of)
+
+    def select(self, filters):
+        """Positions matching every filter (values within one facet are OR-ed), or None for no filter."""
+        selected = None
+
+        def narrow(positions):
+            nonlocal selected
+            selected = set(positions) if selected is None else selected & positions
+
+        if filters.date_from or filters.date_to:
+            lo = bisect_left(self.created_dates, filters.date_from) if filters.date_from else 0
+            hi = bisect_right(self.created_dates, filters.date_to) if filters.date_to else len(self.created_dates)
+            narrow(frozenset(self.created_positions[lo:hi]))
+
+        if filters.countries:
+            names = [self.country_by_folded.get(fold_text(country)) for country in filters.countries]
+            narrow(frozenset().union(*(self.country.get(name, frozenset()) for name in names)))
+
+        if filters.statuses:
+            narrow(frozenset().union(*(self.status.get(status.lower(), frozenset()) for status in filters.statuses)))
+
+        for section in filters.sections:
+            narrow(self.section.get(section.lower(), frozenset()))
+
+        return selected
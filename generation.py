@@ -0,0 +1,27 @@
+import json
+import os
+
+# Written by vectorize_data.py after every rebuild; readers use it to detect new indexes
+GENERATION_FILE = "index_generation.json"
+
+
+def read_generation(path=GENERATION_FILE):
+    """Returns the current index generation number (0 if never built)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("generation", 0)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+
+
+def bump_generation(path=GENERATION_FILE):
+    """Increments the generation number, replacing the file atomically."""
+    generation = read_generation(path) + 1
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation}, f)
+    os.replace(tmp_path, path)
+
+    print(f"✅ Index generation bumped to {generation}")
+    return generation
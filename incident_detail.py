@@ -7,7 +7,7 @@ st.set_page_config(page_title="Detalles del Incidente", page_icon="📄", layout
 query_params = st.experimental_get_query_params()
 incident_id = query_params.get("incident_id", [""])[0]
 
-API_BASE_URL = "http://127.0.0.1:8000/search_incident"
+API_BASE_URL = "http://127.0.0.1:8000/record/incidents"
 
 if incident_id:
     st.markdown(f"<h1>📄 Detalles del Incidente: {incident_id}</h1>", unsafe_allow_html=True)
@@ -15,17 +15,18 @@ if incident_id:
     # Fetch incident details
     with st.spinner("🔄 Cargando detalles..."):
         try:
-            response = requests.get(API_BASE_URL, params={"query": incident_id, "num_results": 1}, timeout=10)
+            # Direct lookup by page id or incident number ("INC-4098" or "4098")
+            response = requests.get(f"{API_BASE_URL}/{incident_id}", timeout=10)
             if response.status_code == 200:
-                incident_data = response.json().get("best_matches", [])[0]
-
-                if incident_data:
-                    for key, value in incident_data.items():
-                        if value:
-                            st.markdown(f"### 📝 {key.replace('_', ' ').capitalize()}")
-                            st.write(value)
-                else:
-                    st.warning("❌ No se encontraron detalles para este incidente.")
+                incident_data = response.json()
+
+                for key, value in incident_data.items():
+                    if value:
+                        st.markdown(f"### 📝 {key.replace('_', ' ').capitalize()}")
+                        st.write(value)
+
+            elif response.status_code == 404:
+                st.warning("❌ No se encontraron detalles para este incidente.")
 
             else:
                 st.error("🚨 No se pudo obtener los detalles del incidente.")
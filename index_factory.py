@@ -0,0 +1,152 @@
+import faiss
+import numpy as np
+
+# Default parameters per index type; a corpus config only needs to override what differs
+INDEX_DEFAULTS = {
+    "flat": {},
+    "hnsw": {"M": 32, "efConstruction": 80, "efSearch": 64},
+    "ivf_flat": {"nlist": 256, "nprobe": 16},
+    "ivf_pq": {"nlist": 256, "nprobe": 16, "m": 48, "nbits": 8},
+    # Flat scan over 8-bit codes, 1 byte per dimension instead of 4 (product quantization is ivf_pq)
+    "sq8": {},
+}
+
+# FAISS needs roughly this many training points per IVF list
+MIN_POINTS_PER_LIST = 39
+# SQ8 only learns the range of each dimension, which a sample this size pins down
+SQ_TRAINING_SIZE = 10000
+
+
+def resolve_config(config):
+    """Fills in defaults: {"type": "hnsw"} -> {"type": "hnsw", "M": 32, ...}."""
+    config = dict(config or {"type": "flat"})
+    kind = config.setdefault("type", "flat")
+    if kind not in INDEX_DEFAULTS:
+        raise ValueError(f"Unknown index type '{kind}', expected one of {', '.join(INDEX_DEFAULTS)}")
+    return {**INDEX_DEFAULTS[kind], **config}
+
+
+def supports_removal(config):
+    """HNSW graphs can't drop vectors, so changed records force a rebuild."""
+    return resolve_config(config)["type"] != "hnsw"
+
+
+def needs_training(config):
+    """IVF and SQ8 indexes learn their lists or value ranges from the data before adding it."""
+    return resolve_config(config)["type"] not in ("flat", "hnsw")
+
+
+def training_size(config):
+    """Vectors a new index of this config is trained on, at most."""
+    config = resolve_config(config)
+    if config["type"].startswith("ivf"):
+        return config["nlist"] * MIN_POINTS_PER_LIST
+    return SQ_TRAINING_SIZE
+
+
+def build_index(config, dim, vectors, ids):
+    """Builds an IndexIDMap2 of the configured type over `vectors` keyed by `ids`."""
+    config = resolve_config(config)
+    kind = config["type"]
+
+    if kind == "flat":
+        base = faiss.IndexFlatL2(dim)
+
+    elif kind == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, config["M"])
+        base.hnsw.efConstruction = config["efConstruction"]
+        base.hnsw.efSearch = config["efSearch"]
+
+    elif kind == "sq8":
+        base = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+        base.train(vectors)
+
+    else:
+        # Small corpora can't train many lists; shrink nlist instead of failing
+        nlist = max(1, min(config["nlist"], len(vectors) // MIN_POINTS_PER_LIST))
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            # Each sub-quantizer needs at least 2^nbits training points; fewer codewords cost
+            # recall, so nbits only shrinks when the corpus can't train the configured ones
+            nbits = max(1, min(config["nbits"], int(np.log2(max(2, len(vectors))))))
+            if nbits < config["nbits"]:
+                print(f"⚠️ Warning: {len(vectors)} vectors can't train {2 ** config['nbits']} PQ codewords, "
+                      f"building ivf_pq with nbits={nbits}")
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, config["m"], nbits)
+        base.train(vectors)
+        base.nprobe = min(config["nprobe"], nlist)
+
+    index = faiss.IndexIDMap2(base)
+    if len(vectors):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+class StreamingIndexBuilder:
+    """Adds batches of vectors to a new or existing index without holding them all in memory.
+
+    Flat and HNSW indexes take every batch as it comes. A new IVF or quantized
+    index first buffers enough vectors to train on (see training_size, or
+    everything if the corpus is smaller), then trains once and streams the rest.
+    """
+
+    def __init__(self, config, dim, index=None):
+        self.config = resolve_config(config)
+        self.dim = dim
+        self.index = index
+        self.pending = []
+        self.pending_count = 0
+        if self.index is None and not needs_training(self.config):
+            self.index = build_index(self.config, dim, np.zeros((0, dim), dtype="float32"), np.zeros(0, dtype="int64"))
+
+    def add(self, vectors, ids):
+        if self.index is not None:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self.pending.append((vectors, ids))
+        self.pending_count += len(vectors)
+        if self.pending_count >= training_size(self.config):
+            self._train()
+
+    def _train(self):
+        vectors = np.vstack([vectors for vectors, _ in self.pending])
+        ids = np.concatenate([ids for _, ids in self.pending])
+        self.pending = []
+        self.index = build_index(self.config, self.dim, vectors, ids)
+
+    def finish(self):
+        """The finished index; trains a new IVF index on whatever was buffered."""
+        if self.index is None:
+            self._train()
+        return self.index
+
+
+def make_search_params(config, nprobe=None, ef_search=None, sel=None):
+    """Per-call search parameters (thread-safe, unlike setting them on the index).
+
+    `sel` is an optional faiss.IDSelector; only ids it accepts are considered
+    during the search, so filtering happens before the top-k cut.
+    """
+    config = resolve_config(config)
+    kind = config["type"]
+
+    # IVF indexes reject parameter objects of any other class, so pick it by index type.
+    # A parameter object replaces the index's own settings, so unset values fall back to the config.
+    if kind == "hnsw" and (ef_search or sel is not None):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or config["efSearch"]
+    elif kind in ("ivf_flat", "ivf_pq") and (nprobe or sel is not None):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or config["nprobe"]
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+
+    if sel is not None:
+        params.sel = sel
+        # SWIG doesn't keep the selector alive on its own
+        params.referenced_objects = [sel]
+    return params
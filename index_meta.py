@@ -0,0 +1,23 @@
+import json
+import os
+
+
+def index_meta_path(faiss_path):
+    """Sidecar with the page id -> content hash map of what a .faiss file contains."""
+    return faiss_path.rsplit(".faiss", 1)[0] + "_meta.json"
+
+
+def load_index_meta(faiss_path):
+    try:
+        with open(index_meta_path(faiss_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_index_meta(faiss_path, meta):
+    path = index_meta_path(faiss_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,210 @@
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+
+# Fields indexed for lexical matching (same ones the old substring fallback scanned)
+LEXICAL_FIELDS = ("número del incidente", "title", "content")
+
+# Incident numbers like "INC-4098" or "R-82145" are kept as a single token
+INCIDENT_TOKEN_RE = re.compile(r"[a-z]+-\d+")
+WORD_RE = re.compile(r"\w+")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def fold_text(text):
+    """Lowercases and strips accents so 'Pagaré' and 'pagare' match the same postings."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Splits text into tokens, keeping incident numbers whole and also as their parts."""
+    folded = fold_text(text)
+    tokens = INCIDENT_TOKEN_RE.findall(folded)
+    tokens.extend(WORD_RE.findall(folded))
+    return tokens
+
+
+class PackedPostingList:
+    """One posting list as slices of the packed arrays; iterates (doc_id, tf) pairs like a built list."""
+
+    def __init__(self, doc_ids, tfs):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return zip(self.doc_ids.tolist(), self.tfs.tolist())
+
+
+class PackedPostings:
+    """Posting lists stored as flat doc id / term frequency arrays, e.g. mapped from the search snapshot.
+
+    Reads like the dict of [doc_id, tf] lists that LexicalIndex.build makes,
+    but loading it is a few array views instead of millions of small lists.
+    """
+
+    def __init__(self, rows, offsets, doc_ids, tfs):
+        # token -> row; the postings of row r are doc_ids[offsets[r]:offsets[r + 1]]
+        self.rows = rows
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+
+    def get(self, token, default=None):
+        row = self.rows.get(token)
+        if row is None:
+            return default
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return PackedPostingList(self.doc_ids[start:end], self.tfs[start:end])
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class LexicalIndex:
+    """Inverted index with BM25 scoring over the records of one corpus."""
+
+    def __init__(self, postings, doc_lengths):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.avg_doc_length = (sum(doc_lengths) / self.num_docs) if self.num_docs else 0.0
+
+    @classmethod
+    def build(cls, records):
+        """Builds the index from a list of records; doc ids are positions in the list."""
+        postings = {}
+        doc_lengths = []
+
+        for doc_id, record in enumerate(records):
+            text = " ".join(str(record.get(field, "")) for field in LEXICAL_FIELDS)
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append([doc_id, tf])
+
+        return cls(postings, doc_lengths)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"doc_lengths": self.doc_lengths, "postings": self.postings}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["postings"], data["doc_lengths"])
+
+    def pack(self):
+        """(token -> row, offsets, doc ids, term frequencies, doc lengths), the arrays of PackedPostings."""
+        rows = {token: row for row, token in enumerate(self.postings)}
+        offsets = np.zeros(len(rows) + 1, dtype="int64")
+        offsets[1:] = np.cumsum([len(postings) for postings in self.postings.values()])
+        pairs = np.array(
+            [pair for postings in self.postings.values() for pair in postings], dtype="int32"
+        ).reshape(-1, 2)
+        return rows, offsets, pairs[:, 0].copy(), pairs[:, 1].copy(), np.array(self.doc_lengths, dtype="int32")
+
+    @classmethod
+    def from_packed(cls, rows, offsets, doc_ids, tfs, doc_lengths):
+        return cls(PackedPostings(rows, offsets, doc_ids, tfs), doc_lengths.tolist())
+
+    def idf(self, token):
+        df = len(self.postings.get(token, ()))
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, query):
+        """Returns {doc_id: bm25} for docs containing every query token.
+
+        Only the posting lists of the query tokens are touched, so the cost does
+        not depend on corpus size.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return {}
+
+        # Walk the shortest posting list first so the intersection shrinks early
+        tokens.sort(key=lambda token: len(self.postings.get(token, ())))
+
+        if isinstance(self.postings, PackedPostings):
+            return self._score_packed(tokens)
+
+        scores = None
+        for token in tokens:
+            token_postings = self.postings.get(token, [])
+            idf = self.idf(token)
+            token_scores = {}
+
+            for doc_id, tf in token_postings:
+                if scores is not None and doc_id not in scores:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_doc_length)
+                token_scores[doc_id] = idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: scores[doc_id] + s for doc_id, s in token_scores.items()}
+
+            if not scores:
+                return {}
+
+        return scores
+
+    def _score_packed(self, tokens):
+        """score() over packed postings, one array operation per token instead of one step per posting.
+
+        Posting lists are in doc id order, so the intersection is a sorted merge
+        and the result has the same order and values as the dict walk.
+        """
+        doc_lengths = np.asarray(self.doc_lengths, dtype="float64")
+        doc_ids = totals = None
+        for token in tokens:
+            postings = self.postings.get(token)
+            if postings is None:
+                return {}
+            token_ids, tfs = postings.doc_ids, postings.tfs.astype("float64")
+            if doc_ids is not None:
+                doc_ids, kept, matched = np.intersect1d(doc_ids, token_ids, assume_unique=True, return_indices=True)
+                totals, token_ids, tfs = totals[kept], token_ids[matched], tfs[matched]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[token_ids] / self.avg_doc_length)
+            token_scores = self.idf(token) * tfs * (BM25_K1 + 1) / (tfs + norm)
+            if doc_ids is None:
+                doc_ids, totals = token_ids, token_scores
+            else:
+                totals = totals + token_scores
+            if not len(doc_ids):
+                return {}
+        return dict(zip(doc_ids.tolist(), totals.tolist()))
+
+    def search(self, query, limit=None):
+        """Returns doc ids containing every query token, best BM25 score first."""
+        scores = self.score(query)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return ranked[:limit] if limit else ranked
+
+
+def lexical_index_path(faiss_path):
+    """The lexical index lives next to its .faiss file."""
+    return faiss_path.rsplit(".faiss", 1)[0] + "_lexical.json"
+
+
+def build_lexical_index(input_file, output_path):
+    """Builds and persists the lexical index for a normalized JSON file."""
+    with open(input_file, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    index = LexicalIndex.build(records)
+    index.save(output_path)
+
+    print(f"✅ Lexical index saved as '{output_path}' ({len(index.postings)} tokens, {index.num_docs} records)")
+    return index
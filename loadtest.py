@@ -0,0 +1,142 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import requests
+
+API_BASE_URL = "http://127.0.0.1:8000"
+
+DEFAULT_QUERIES = [
+    "pagaré", "error en cuota", "cuenta cancelada", "débito automático", "separar cuentas",
+    "cartera", "consulta activación", "reprocesamiento", "costa rica", "méxico",
+]
+
+# The API's QUERY_CACHE_SIZE default; cycling through more distinct queries than this never hits its caches
+API_QUERY_CACHE_SIZE = 2048
+# Distinct queries generated for uncached runs
+UNCACHED_QUERIES = 4 * API_QUERY_CACHE_SIZE
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(url, params_for, concurrency, duration):
+    """Hammers `url` from `concurrency` threads for `duration` seconds; returns QPS and latency percentiles."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(seed):
+        nonlocal errors
+        rng = random.Random(seed)
+        session = requests.Session()
+        local, local_errors = [], 0
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = session.get(url, params=params_for(rng), timeout=60)
+                ok = response.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def distinct_queries(queries, count, seed=1):
+    """Up to `count` distinct queries of 1-3 words taken from `queries`.
+
+    Every word is one the corpus has, so the lexical filter keeps real hits;
+    an unseen token (a random number, say) would empty most result lists.
+    """
+    rng = random.Random(seed)
+    words = list(dict.fromkeys(word for query in queries for word in query.split()))
+    combos = (" ".join(rng.sample(words, rng.randint(1, min(3, len(words))))) for _ in range(count * 4))
+    return list(dict.fromkeys(combos))[:count]
+
+
+def query_cycle(queries):
+    """Thread-safe next query, in order, starting over at the end.
+
+    With more queries than the API caches hold, a query has been evicted
+    by the time it comes around again, so no request is a cache hit.
+    """
+    lock = threading.Lock()
+    queries = itertools.cycle(queries)
+
+    def next_query():
+        with lock:
+            return next(queries)
+    return next_query
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP load test for the search API (QPS and p50/p95/p99).")
+    parser.add_argument("--base-url", default=API_BASE_URL)
+    parser.add_argument("--endpoint", default="/search")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level")
+    parser.add_argument("--num-results", type=int, default=20)
+    parser.add_argument("--queries-file", help="One query per line (default: built-in list)")
+    parser.add_argument("--cached", action="store_true", help="Repeat queries verbatim so caches can hit")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    if not args.cached:
+        queries = distinct_queries(queries, UNCACHED_QUERIES)
+        if len(queries) <= API_QUERY_CACHE_SIZE:
+            print(f"⚠️ Warning: only {len(queries)} distinct queries, some requests will hit the API caches; "
+                  f"use a --queries-file with more words")
+        next_query = query_cycle(queries)
+
+    def params_for(rng):
+        query = rng.choice(queries) if args.cached else next_query()
+        return {"query": query, "num_results": args.num_results}
+
+    url = args.base_url + args.endpoint
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        result = run_load(url, params_for, concurrency, args.duration)
+        results.append(result)
+        print(f"🔥 c={result['concurrency']:<4} qps={result['qps']:>8.1f}  p50={result['p50_ms']:>7.1f}ms  "
+              f"p95={result['p95_ms']:>7.1f}ms  p99={result['p99_ms']:>7.1f}ms  errors={result['errors']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "results": results}, f, indent=4)
+        print(f"✅ Results saved to {args.output}")
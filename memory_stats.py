@@ -0,0 +1,35 @@
+import os
+
+# /proc/<pid>/smaps_rollup fields worth reporting, in kB
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def process_memory(pid="self"):
+    """Resident vs shared memory of a process in MB (Linux only, empty elsewhere).
+
+    Pss splits shared pages evenly between the processes mapping them, so the sum
+    of Pss over all workers is the real memory cost of the server.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            lines = f.readlines()
+    except OSError:
+        return {}
+
+    stats = {}
+    for line in lines:
+        parts = line.split()
+        if parts and parts[0].rstrip(":") in SMAPS_FIELDS:
+            stats[parts[0].rstrip(":").lower() + "_mb"] = round(int(parts[1]) / 1024, 1)
+
+    if stats:
+        stats["shared_mb"] = round(stats.get("shared_clean_mb", 0) + stats.get("shared_dirty_mb", 0), 1)
+        stats["private_mb"] = round(stats.get("private_clean_mb", 0) + stats.get("private_dirty_mb", 0), 1)
+    return stats
+
+
+def format_memory(pid, stats):
+    if not stats:
+        return f"pid {pid}: memory stats unavailable"
+    return (f"pid {pid}: rss={stats['rss_mb']}MB pss={stats['pss_mb']}MB "
+            f"shared={stats['shared_mb']}MB private={stats['private_mb']}MB")
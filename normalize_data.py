@@ -1,111 +1,267 @@
+import argparse
 import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from facets import FacetIndexBuilder, facets_path
+
+FIELD_PATTERNS = [
+    "descripción del problema", "análisis y acciones tomadas", "resultado del reprocesamiento",
+    "validación y cierre", "solución aplicada", "código proporcionado", "sistema relacionado",
+    "flujo relacionado", "solución", "causa raíz relacionada", "tipo solución", "notas adicionales",
+    "caso relacionado", "causa", "próximos pasos", "tareas asignadas", "propietario", "fecha",
+    "identificación del problema", "consultas realizadas", "etiquetas solución", "resultado",
+    "código usado", "script SQL", "procedimiento almacenado (SP)", "query", "sentencia SQL",
+    "consulta SQL", "transacción", "ejemplo de código", "ejemplo de consulta", "ejecución de query",
+    "consulta en base de datos", "ejecución manual", "procedimiento ejecutado", "query usado",
+    "consulta utilizada", "ejemplo de query", "título del incidente", "número del incidente",
+    "descripción del incidente", "análisis del incidente", "detalle técnico", "solución técnica",
+    "causa raíz", "causa negocio", "solución negocio", "afectación", "fecha de hoy"
+]
+
+# Fields whose value is code and must be kept verbatim (compared against the lowercased field name)
+CODE_KEYWORDS = frozenset([
+    "código proporcionado", "script SQL", "procedimiento almacenado (SP)", "query",
+    "sentencia SQL", "consulta SQL", "transacción", "ejemplo de código", "ejemplo de consulta",
+    "ejecución de query", "consulta en base de datos", "ejecución manual",
+    "procedimiento ejecutado", "query usado", "consulta utilizada", "ejemplo de query", "script sql"
+])
+
+SQL_KEYWORDS = ("select", "from", "where", "update", "insert", "exec", "begin", "commit", "rollback")
+
+# Compiled once per process instead of once per record
+FIELD_SPLIT_RE = re.compile(
+    "(" + "|".join(re.escape(pattern) for pattern in FIELD_PATTERNS) + "):?", re.IGNORECASE
+)
+BOLD_RE = re.compile(r"\*\*(.*?)\*\*")
+UPPERCASE_LINE_RE = re.compile(r"\n([A-ZÁÉÍÓÚÜÑ\s]+)\n")
+WHITESPACE_RE = re.compile(r'\s+')
+SEPARATOR_RE = re.compile(r"[\s,]*")
+
+# Pages per task sent to the process pool, and how many tasks may be in flight per worker
+CHUNK_SIZE = 64
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
 
 def clean_text(text):
     """Elimina espacios extra y caracteres innecesarios, pero conserva listas y código correctamente."""
-    
+
     text = text.replace("•", "-")
-    
-    if any(keyword in text.lower() for keyword in ["select", "from", "where", "update", "insert", "exec", "begin", "commit", "rollback"]):
+
+    lowered = text.lower()
+    if any(keyword in lowered for keyword in SQL_KEYWORDS):
         return text
 
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = WHITESPACE_RE.sub(' ', text).strip()
     text = text.replace(". ", ".\n- ")
 
     return text
 
-def extract_incident_sections(content):
+def extract_incident_sections(content, verbose=True):
     """Extrae campos estructurados de los reportes de incidencias, preservando listas y código."""
-    
-    sections = {}
 
-    field_patterns = [
-        "descripción del problema", "análisis y acciones tomadas", "resultado del reprocesamiento",
-        "validación y cierre", "solución aplicada", "código proporcionado", "sistema relacionado",
-        "flujo relacionado", "solución", "causa raíz relacionada", "tipo solución", "notas adicionales",
-        "caso relacionado", "causa", "próximos pasos", "tareas asignadas", "propietario", "fecha",
-        "identificación del problema", "consultas realizadas", "etiquetas solución", "resultado",
-        "código usado", "script SQL", "procedimiento almacenado (SP)", "query", "sentencia SQL", 
-        "consulta SQL", "transacción", "ejemplo de código", "ejemplo de consulta", "ejecución de query",
-        "consulta en base de datos", "ejecución manual", "procedimiento ejecutado", "query usado",
-        "consulta utilizada", "ejemplo de query", "título del incidente", "número del incidente", 
-        "descripción del incidente", "análisis del incidente", "detalle técnico", "solución técnica",
-        "causa raíz", "causa negocio", "solución negocio", "afectación", "fecha de hoy"
-    ]
-
-    field_regex = "|".join(fr"(?i){re.escape(pattern)}" for pattern in field_patterns)
+    sections = {}
 
-    content = re.sub(r"\*\*(.*?)\*\*", r"\n\1:\n", content)
-    content = re.sub(r"\n([A-ZÁÉÍÓÚÜÑ\s]+)\n", r"\n\1:\n", content)
+    content = BOLD_RE.sub(r"\n\1:\n", content)
+    content = UPPERCASE_LINE_RE.sub(r"\n\1:\n", content)
 
-    matches = re.split(f"({field_regex}):?", content, flags=re.IGNORECASE)
+    matches = FIELD_SPLIT_RE.split(content)
 
     for i in range(1, len(matches) - 1, 2):
         field_name = matches[i].strip().lower()
         field_value = matches[i + 1].strip()
 
-        code_keywords = [
-            "código proporcionado", "script SQL", "procedimiento almacenado (SP)", "query", 
-            "sentencia SQL", "consulta SQL", "transacción", "ejemplo de código", "ejemplo de consulta",
-            "ejecución de query", "consulta en base de datos", "ejecución manual", 
-            "procedimiento ejecutado", "query usado", "consulta utilizada", "ejemplo de query", "script sql"
-        ]
-
-        if field_name in code_keywords:
+        if field_name in CODE_KEYWORDS:
             sections[field_name] = field_value
-        elif field_value:  
+        elif field_value:
             sections[field_name] = clean_text(field_value)
 
-    print(f"✅ Extracted Fields:\n{json.dumps(sections, indent=4, ensure_ascii=False)}")
+    if verbose:
+        print(f"✅ Extracted Fields:\n{json.dumps(sections, indent=4, ensure_ascii=False)}")
     return sections
 
-def normalize_confluence_data(input_file, output_file, structured=True, add_status=False):
-    """Procesa Confluence data y aplica extracción estructurada si es necesario."""
-    with open(input_file, "r", encoding="utf-8") as f:
-        pages = json.load(f)
-
-    normalized_pages = []
-    for page in pages:
-        raw_content = page.get("content", "").strip()
-        created_at = page.get("created", "Unknown")  # ✅ Ensure created timestamp is included
-
-        if not raw_content:
-            print(f"⚠️ Warning: Empty content for page ID {page['id']}")
-            continue
-
-        if not structured:
-            incident_data = {
-                "id": page["id"],
-                "title": page["title"],
-                "created": created_at,  # ✅ Add created timestamp
-                "content": raw_content
-            }
-        else:
-            structured_data = extract_incident_sections(raw_content)
-
-            if add_status and "causa raíz" in page["title"].lower():
-                if "en curso" in page["title"].lower():
-                    structured_data["status"] = "en curso"
-                elif "completado" in page["title"].lower():
-                    structured_data["status"] = "completado"
-
-            incident_data = {
-                "id": page["id"],
-                "title": page["title"],
-                "created": created_at,  # ✅ Add created timestamp
-                "content": raw_content,
-                **structured_data
-            }
-
-        normalized_pages.append(incident_data)
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(normalized_pages, f, indent=4, ensure_ascii=False)
+def clean_sections(sections, verbose=True):
+    """Applies the same value cleaning as extract_incident_sections to pre-extracted sections."""
+    cleaned = {}
+    for field_name, field_value in sections.items():
+        if field_name in CODE_KEYWORDS:
+            cleaned[field_name] = field_value
+        elif field_value:
+            cleaned[field_name] = clean_text(field_value)
+
+    if verbose:
+        print(f"✅ Extracted Fields:\n{json.dumps(cleaned, indent=4, ensure_ascii=False)}")
+    return cleaned
+
+def normalize_page(page, structured=True, add_status=False, verbose=True):
+    """Normaliza una página; devuelve None si no tiene contenido."""
+    raw_content = page.get("content", "").strip()
+    created_at = page.get("created", "Unknown")  # ✅ Ensure created timestamp is included
+
+    if not raw_content:
+        return None
+
+    if not structured:
+        return {
+            "id": page["id"],
+            "title": page["title"],
+            "created": created_at,  # ✅ Add created timestamp
+            "content": raw_content
+        }
+
+    if page.get("sections"):
+        # Sections already extracted from the storage XHTML by extract_confluence.py
+        structured_data = clean_sections(page["sections"], verbose)
+    else:
+        structured_data = extract_incident_sections(raw_content, verbose)
+
+    if add_status and "causa raíz" in page["title"].lower():
+        if "en curso" in page["title"].lower():
+            structured_data["status"] = "en curso"
+        elif "completado" in page["title"].lower():
+            structured_data["status"] = "completado"
+
+    return {
+        "id": page["id"],
+        "title": page["title"],
+        "created": created_at,  # ✅ Add created timestamp
+        "content": raw_content,
+        **structured_data
+    }
+
+def normalize_chunk(pages, structured=True, add_status=False, verbose=True):
+    """Process pool task: normalizes a list of pages."""
+    return [normalize_page(page, structured, add_status, verbose) for page in pages]
+
+def iter_json_array(path, buffer_size=1 << 20):
+    """Yields the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(buffer_size)
+        pos = SEPARATOR_RE.match(buffer).end()
+        if buffer[pos:pos + 1] != "[":
+            raise ValueError(f"{path} is not a JSON array")
+        pos += 1
+        eof = False
+
+        while True:
+            pos = SEPARATOR_RE.match(buffer, pos).end()
+            if buffer[pos:pos + 1] == "]":
+                return
+
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element continues past the buffer: read more and retry
+                more = f.read(buffer_size)
+                eof = not more
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+
+            yield element
+            pos = end
+
+class JsonArrayWriter:
+    """Writes a JSON array one element at a time, byte-identical to json.dump(list, indent=4)."""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, element):
+        text = json.dumps(element, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        self.f.write(("[\n    " if self.count == 0 else ",\n    ") + text)
+        self.count += 1
+
+    def close(self):
+        self.f.write("[]" if self.count == 0 else "\n]")
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def map_chunks_ordered(executor, fn, chunks, max_in_flight):
+    """Like executor.map, but only keeps `max_in_flight` chunks submitted at a time."""
+    pending = []
+    for chunk in chunks:
+        pending.append((chunk, executor.submit(fn, chunk)))
+        if len(pending) >= max_in_flight:
+            chunk, future = pending.pop(0)
+            yield chunk, future.result()
+    for chunk, future in pending:
+        yield chunk, future.result()
+
+def normalize_confluence_data(input_file, output_file, structured=True, add_status=False,
+                              verbose=True, executor=None, max_in_flight=8):
+    """Procesa Confluence data y aplica extracción estructurada si es necesario.
+
+    Pages are streamed from `input_file` and written to `output_file` as they are
+    normalized; with an `executor` (process pool) chunks of pages are normalized in
+    parallel while output order stays the same. The facet index used for filtered
+    search is collected on the way and saved next to `output_file`.
+    """
+    task = partial(normalize_chunk, structured=structured, add_status=add_status, verbose=verbose)
+    chunks = iter_chunks(iter_json_array(input_file), CHUNK_SIZE)
+
+    if executor is None:
+        results = ((chunk, task(chunk)) for chunk in chunks)
+    else:
+        results = map_chunks_ordered(executor, task, chunks, max_in_flight)
+
+    facets = FacetIndexBuilder()
+
+    tmp_path = output_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        writer = JsonArrayWriter(f)
+        for pages, normalized in results:
+            for page, incident_data in zip(pages, normalized):
+                if incident_data is None:
+                    print(f"⚠️ Warning: Empty content for page ID {page['id']}")
+                    continue
+                writer.write(incident_data)
+                facets.add(incident_data)
+        writer.close()
+    os.replace(tmp_path, output_file)
+    facets.save(facets_path(output_file))
 
     print(f"✅ {output_file} saved.")
 
+DATASETS = [
+    ("incidentes_prenorm.json", "normalized_incidents.json", {"structured": True}),
+    ("solicitudes_prenorm.json", "normalized_solicitudes.json", {"structured": True}),
+    ("causaraiz_prenorm.json", "normalized_causaraiz.json", {"structured": True, "add_status": True}),
+    ("postmortem_prenorm.json", "normalized_postmortem.json", {"structured": True}),
+]
+
 if __name__ == "__main__":
-    normalize_confluence_data("incidentes_prenorm.json", "normalized_incidents.json", structured=True)
-    normalize_confluence_data("solicitudes_prenorm.json", "normalized_solicitudes.json", structured=True)
-    normalize_confluence_data("causaraiz_prenorm.json", "normalized_causaraiz.json", structured=True, add_status=True)
-    normalize_confluence_data("postmortem_prenorm.json", "normalized_postmortem.json", structured=True)
+    parser = argparse.ArgumentParser(description="Normalize the Confluence exports.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes (1 = no pool)")
+    parser.add_argument("--quiet", action="store_true", help="Don't print the extracted fields of every record")
+    args = parser.parse_args()
+
+    verbose = not args.quiet
+
+    if args.workers <= 1:
+        for input_file, output_file, options in DATASETS:
+            normalize_confluence_data(input_file, output_file, verbose=verbose, **options)
+    else:
+        # One shared process pool; each corpus is streamed through it by its own thread
+        with ProcessPoolExecutor(max_workers=args.workers) as pool, ThreadPoolExecutor(len(DATASETS)) as corpora:
+            futures = [
+                corpora.submit(
+                    normalize_confluence_data, input_file, output_file, verbose=verbose,
+                    executor=pool, max_in_flight=args.workers * CHUNKS_IN_FLIGHT_PER_WORKER, **options
+                )
+                for input_file, output_file, options in DATASETS
+            ]
+            for future in futures:
+                future.result()
@@ -0,0 +1,47 @@
+# Passage ids are parent page id * PASSAGE_ID_FACTOR + passage number, so the
+# parent is one integer division away and a record can have this many passages
+PASSAGE_ID_FACTOR = 1000
+
+# Passages fetched per wanted record, since several passages of one record can rank high
+PASSAGE_OVERFETCH = 4
+
+
+def is_chunked(config):
+    """True when an index config splits records into passages ({"chunk_words": 160, ...})."""
+    return bool(config and config.get("chunk_words"))
+
+
+def split_passages(text, words, overlap=0):
+    """Splits text into windows of `words` words, consecutive windows sharing `overlap` words."""
+    tokens = text.split()
+    if len(tokens) <= words:
+        return [" ".join(tokens)] if tokens else []
+
+    step = max(1, words - overlap)
+    passages = []
+    for start in range(0, len(tokens), step):
+        passages.append(" ".join(tokens[start:start + words]))
+        if start + words >= len(tokens):
+            break
+    return passages
+
+
+def record_passages(page_id, text, config):
+    """(FAISS id, text) pairs a record is indexed as: itself, or its passages when chunked."""
+    if not is_chunked(config):
+        return [(page_id, text)]
+
+    passages = split_passages(text, config["chunk_words"], config.get("chunk_overlap", 0))
+    if len(passages) > PASSAGE_ID_FACTOR:
+        print(f"⚠️ Warning: page {page_id} has {len(passages)} passages, indexing the first {PASSAGE_ID_FACTOR}")
+        passages = passages[:PASSAGE_ID_FACTOR]
+    return [(page_id * PASSAGE_ID_FACTOR + n, passage) for n, passage in enumerate(passages)]
+
+
+def passage_ids(page_id, count):
+    return [page_id * PASSAGE_ID_FACTOR + n for n in range(count)]
+
+
+def parent_ids(ids):
+    """Parent page ids of passage hits, best first, each parent once (its best passage's rank)."""
+    return list(dict.fromkeys(int(i) // PASSAGE_ID_FACTOR for i in ids if i != -1))
@@ -0,0 +1,154 @@
+import json
+import mmap
+import os
+import re
+import sys
+import numpy as np
+
+# Fields kept in memory for every record; everything else is decoded only for returned hits
+LIGHT_FIELDS = ("id", "title", "número del incidente", "created", "status")
+
+# "INC-4098", "inc 4098", "4098" and "INC-4098 - Consulta Pagaré" all become "4098"
+INCIDENT_NUMBER_RE = re.compile(r"(?:\bINC[\s\-_]*)?(\d+)", re.IGNORECASE)
+TITLE_INCIDENT_RE = re.compile(r"\bINC[\s\-_]*(\d+)", re.IGNORECASE)
+
+
+def record_store_paths(json_path):
+    """normalized_x.json -> (records file, offsets file, light fields file)."""
+    base = json_path.rsplit(".json", 1)[0]
+    return base + ".records", base + ".records.idx.npy", base + ".records.light.json"
+
+
+def light_record(record):
+    return {field: record[field] for field in LIGHT_FIELDS if field in record}
+
+
+def incident_key(value):
+    """Normalizes an incident number for hash lookups, or None if it has no number."""
+    match = INCIDENT_NUMBER_RE.search(str(value))
+    return (match.group(1).lstrip("0") or "0") if match else None
+
+
+def record_lookups(light, id_mapped=False):
+    """Hash maps over the light records: (FAISS id, page id, incident number) -> position.
+
+    The FAISS id map is None for legacy indexes, which return positions directly.
+    """
+    # ID-mapped indexes return Confluence page ids; legacy ones return row numbers
+    faiss_to_pos = None
+    if id_mapped:
+        faiss_to_pos = {int(record["id"]): i for i, record in enumerate(light) if str(record.get("id", "")).isdigit()}
+
+    by_page_id = {}
+    by_incident_number = {}
+    for i, record in enumerate(light):
+        if record.get("id"):
+            by_page_id.setdefault(str(record["id"]), i)
+
+        # Prefer the extracted field; titles like "INC-4098 - ..." are the fallback
+        key = incident_key(record.get("número del incidente", ""))
+        if key is None:
+            title_match = TITLE_INCIDENT_RE.search(record.get("title", ""))
+            key = incident_key(title_match.group(1)) if title_match else None
+        if key is not None:
+            by_incident_number.setdefault(key, i)
+
+    return faiss_to_pos, by_page_id, by_incident_number
+
+
+def compact_records(records):
+    """Yields the compact JSON bytes of each record; a record store body is their concatenation."""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def convert_json_to_record_store(json_path):
+    """Converts a normalized_*.json list into the compact record store format."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    records_path, offsets_path, light_path = record_store_paths(json_path)
+    offsets = np.zeros(len(records) + 1, dtype="int64")
+
+    with open(records_path + ".tmp", "wb") as f:
+        for i, encoded in enumerate(compact_records(records)):
+            f.write(encoded)
+            offsets[i + 1] = f.tell()
+
+    with open(offsets_path + ".tmp", "wb") as f:
+        np.save(f, offsets)
+
+    with open(light_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump([light_record(record) for record in records], f, ensure_ascii=False)
+
+    # Swapped in only once all three are fully written, so a crash never leaves a partial file
+    for path in (records_path, offsets_path, light_path):
+        os.replace(path + ".tmp", path)
+
+    print(f"✅ Record store saved as '{records_path}' ({len(records)} records, {offsets[-1]} bytes)")
+
+
+def is_record_store_fresh(json_path):
+    """True when a record store exists and is not older than its JSON source."""
+    paths = record_store_paths(json_path)
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    return not os.path.exists(json_path) or os.path.getmtime(paths[0]) >= os.path.getmtime(json_path)
+
+
+class RecordStore:
+    """Read-only, memory-mapped list of records.
+
+    Behaves like the list returned by json.load: len(), indexing and iteration,
+    but a record is only decoded when it is accessed. The mapped pages live in the
+    OS page cache, so they are shared by every process that opens the store.
+    """
+
+    def __init__(self, json_path):
+        records_path, offsets_path, light_path = record_store_paths(json_path)
+
+        self._file = open(records_path, "rb")
+        size = os.path.getsize(records_path)
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._base = 0
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+
+        with open(light_path, "r", encoding="utf-8") as f:
+            self.light = json.load(f)
+
+    @classmethod
+    def from_buffer(cls, buffer, base, offsets, light):
+        """A store over records starting at `base` inside an already mapped file (see search_snapshot.py)."""
+        store = cls.__new__(cls)
+        store._file = None
+        store._mm = buffer
+        store._base = base
+        store.offsets = offsets
+        store.light = light
+        return store
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("record index out of range")
+        return json.loads(self._mm[self._base + int(self.offsets[i]):self._base + int(self.offsets[i + 1])])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+if __name__ == "__main__":
+    json_files = sys.argv[1:] or [
+        "normalized_incidents.json",
+        "normalized_solicitudes.json",
+        "normalized_causaraiz.json",
+        "normalized_postmortem.json",
+    ]
+
+    for json_file in json_files:
+        convert_json_to_record_store(json_file)
@@ -0,0 +1,249 @@
+import json
+import os
+import faiss
+import numpy as np
+from embedding_cache import EmbeddingCache
+from index_meta import load_index_meta
+from passages import PASSAGE_ID_FACTOR
+from search_snapshot import available_corpora
+
+RELATED_GRAPH_FILE = "related_graph.npz"
+# Model, k and the page id -> content hash maps the graph was computed from
+RELATED_GRAPH_META_FILE = "related_graph_meta.json"
+
+# Neighbours kept per record and target corpus
+RELATED_K = 10
+
+# Query vectors per FAISS search call
+GRAPH_BATCH_SIZE = 4096
+
+
+def reconstruct_vectors(index):
+    """(FAISS ids, vectors) stored in an IndexIDMap2, read back from the index itself."""
+    base = faiss.downcast_index(index.index)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        # IVF lists can only be read back by position through a direct map
+        ivf.make_direct_map()
+    return faiss.vector_to_array(index.id_map).astype("int64"), base.reconstruct_n(0, base.ntotal)
+
+
+def corpus_vectors(faiss_path, model_name, embedding_cache):
+    """(sorted page ids, unit-length vectors) of the records in an index.
+
+    Record vectors come from the embedding cache; chunked indexes hold passage
+    vectors, which are averaged per record.
+    """
+    meta = load_index_meta(faiss_path)
+    if not meta:
+        raise ValueError(f"{faiss_path} has no meta sidecar; run vectorize_data.py first.")
+
+    if "passages" in meta:
+        ids, vectors = reconstruct_vectors(faiss.read_index(faiss_path))
+        page_ids, parents = np.unique(ids // PASSAGE_ID_FACTOR, return_inverse=True)
+        sums = np.zeros((len(page_ids), vectors.shape[1]), dtype="float32")
+        np.add.at(sums, parents, vectors)
+        vectors = sums
+    else:
+        found = embedding_cache.get_many(model_name, meta["ids"].values())
+        page_ids = np.array(sorted(int(page_id) for page_id, h in meta["ids"].items() if h in found), dtype="int64")
+        if len(page_ids) < len(meta["ids"]):
+            print(f"⚠️ Warning: {len(meta['ids']) - len(page_ids)} records of {faiss_path} are not in the "
+                  f"embedding cache and get no related records")
+        if not len(page_ids):
+            return page_ids, np.zeros((0, faiss.read_index(faiss_path).d), dtype="float32")
+        vectors = np.stack([found[meta["ids"][str(page_id)]] for page_id in page_ids]).astype("float32")
+
+    faiss.normalize_L2(vectors)
+    return page_ids, vectors
+
+
+def nearest(queries, query_ids, target_vectors, target_ids, k, exclude_self):
+    """Top-k (page ids, cosine scores) of each query among the targets, -1 padded, best first."""
+    ids = np.full((len(queries), k), -1, dtype="int64")
+    scores = np.full((len(queries), k), -np.inf, dtype="float32")
+    if not len(queries) or not len(target_ids):
+        return ids, scores
+
+    index = faiss.IndexFlatIP(target_vectors.shape[1])
+    index.add(target_vectors)
+    # One extra neighbour, since a record is its own nearest neighbour within its corpus
+    search_k = min(k + int(exclude_self), len(target_ids))
+
+    for start in range(0, len(queries), GRAPH_BATCH_SIZE):
+        batch = slice(start, start + GRAPH_BATCH_SIZE)
+        found_scores, found = index.search(queries[batch], search_k)
+        found_ids = np.where(found >= 0, target_ids[found], -1)
+        found_scores[found < 0] = -np.inf
+        if exclude_self:
+            found_scores[found_ids == query_ids[batch, None]] = -np.inf
+        ids[batch], scores[batch] = top_k(found_ids, found_scores, k)
+
+    return ids, scores
+
+
+def top_k(ids, scores, k):
+    """Best k of each row; entries scored -inf become -1."""
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    ids = np.take_along_axis(ids, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
+    ids[np.isneginf(scores)] = -1
+    if ids.shape[1] < k:
+        pad = k - ids.shape[1]
+        ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+        scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+    return ids, scores
+
+
+def changed_ids(old_hashes, new_hashes):
+    """Page ids whose content was removed or changed, and ids that are new or changed."""
+    stale = {int(page_id) for page_id, h in old_hashes.items() if new_hashes.get(page_id) != h}
+    added = {int(page_id) for page_id, h in new_hashes.items() if old_hashes.get(page_id) != h}
+    return stale, added
+
+
+def load_graph_meta(path=RELATED_GRAPH_META_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def build_related_graph(corpus_files, model_name, k=RELATED_K, path=RELATED_GRAPH_FILE,
+                        meta_path=RELATED_GRAPH_META_FILE):
+    """Computes the top-k related records of every record, within its corpus and in every other one.
+
+    Only what changed is searched again: rows of new or changed records, rows
+    that lost a neighbour to a removed or changed record, and the new records
+    of each target corpus against the rows that are kept.
+    """
+    corpus_files = available_corpora(corpus_files)
+    hashes = {}
+    for name, (faiss_path, _) in list(corpus_files.items()):
+        index_meta = load_index_meta(faiss_path)
+        if not index_meta:
+            print(f"⚠️ Warning: {faiss_path} has no meta sidecar, the {name} corpus gets no related records.")
+            del corpus_files[name]
+            continue
+        hashes[name] = index_meta["ids"]
+
+    meta = load_graph_meta(meta_path)
+    old = None
+    old_hashes = {}
+    if meta and meta.get("model") == model_name and meta.get("k") == k and os.path.exists(path):
+        old_hashes = meta["corpora"]
+        if hashes == old_hashes:
+            print(f"✅ '{path}' is up to date")
+            return
+        with np.load(path) as f:
+            old = dict(f)
+
+    embedding_cache = EmbeddingCache()
+    vectors = {
+        name: corpus_vectors(faiss_path, model_name, embedding_cache)
+        for name, (faiss_path, _) in corpus_files.items()
+    }
+
+    arrays = {}
+    for source, (source_ids, source_vectors) in vectors.items():
+        arrays[f"{source}.ids"] = source_ids
+
+        for target, (target_ids, target_vectors) in vectors.items():
+            exclude_self = source == target
+            known = old is not None and source in old_hashes and target in old_hashes
+
+            if not known:
+                ids, scores = nearest(source_vectors, source_ids, target_vectors, target_ids, k, exclude_self)
+            else:
+                _, source_added = changed_ids(old_hashes[source], hashes[source])
+                target_stale, target_added = changed_ids(old_hashes[target], hashes[target])
+                ids, scores = update_rows(
+                    source_ids, source_vectors, target_ids, target_vectors,
+                    old[f"{source}.ids"], old[f"{source}.{target}.ids"], old[f"{source}.{target}.scores"],
+                    source_added, target_stale, target_added, k, exclude_self,
+                )
+
+            arrays[f"{source}.{target}.ids"] = ids
+            arrays[f"{source}.{target}.scores"] = scores
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "k": k, "corpora": hashes}, f)
+    os.replace(tmp_path, meta_path)
+
+    print(f"✅ Related records graph ({k} per corpus) saved as '{path}'")
+
+
+def update_rows(source_ids, source_vectors, target_ids, target_vectors, old_ids, old_neighbors, old_scores,
+                source_added, target_stale, target_added, k, exclude_self):
+    """Incremental update of one (source, target) block of the graph."""
+    ids = np.full((len(source_ids), k), -1, dtype="int64")
+    scores = np.full((len(source_ids), k), -np.inf, dtype="float32")
+
+    old_rows = {page_id: row for row, page_id in enumerate(old_ids.tolist())}
+    rows = np.array([old_rows.get(page_id, -1) for page_id in source_ids.tolist()], dtype="int64")
+    kept = (rows >= 0) & ~np.isin(source_ids, list(source_added))
+    ids[kept] = old_neighbors[rows[kept]]
+    scores[kept] = old_scores[rows[kept]]
+
+    # A row that lost a neighbour doesn't know its next best one, so it is searched again
+    lost = np.isin(ids, list(target_stale)) & kept[:, None]
+    full = ~kept | lost.any(axis=1)
+    if full.any():
+        ids[full], scores[full] = nearest(
+            source_vectors[full], source_ids[full], target_vectors, target_ids, k, exclude_self
+        )
+
+    incremental = ~full
+    if target_added and incremental.any():
+        added = np.isin(target_ids, list(target_added))
+        new_ids, new_scores = nearest(
+            source_vectors[incremental], source_ids[incremental], target_vectors[added], target_ids[added], k,
+            exclude_self,
+        )
+        ids[incremental], scores[incremental] = top_k(
+            np.concatenate([ids[incremental], new_ids], axis=1),
+            np.concatenate([scores[incremental], new_scores], axis=1),
+            k,
+        )
+
+    return ids, scores
+
+
+class RelatedGraph:
+    """The precomputed related records, looked up by corpus and page id."""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        # corpus -> {page id: row}
+        self.rows = {
+            name.rsplit(".", 1)[0]: {page_id: row for row, page_id in enumerate(array.tolist())}
+            for name, array in arrays.items() if name.count(".") == 1
+        }
+
+    @classmethod
+    def load(cls, path=RELATED_GRAPH_FILE):
+        with np.load(path) as f:
+            return cls(dict(f))
+
+    def related(self, corpus, page_id, targets=None, limit=None):
+        """{target corpus: [(page id, score), ...]} for one record, or None if it isn't in the graph."""
+        row = self.rows.get(corpus, {}).get(int(page_id))
+        if row is None:
+            return None
+
+        related = {}
+        for target in targets or self.rows:
+            key = f"{corpus}.{target}"
+            if f"{key}.ids" not in self.arrays:
+                continue
+            ids = self.arrays[f"{key}.ids"][row][:limit]
+            scores = self.arrays[f"{key}.scores"][row][:limit]
+            related[target] = [(int(i), float(s)) for i, s in zip(ids, scores) if i != -1]
+        return related
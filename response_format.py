@@ -0,0 +1,84 @@
+import base64
+import json
+import time
+from fastapi.responses import JSONResponse
+from lexical_index import fold_text, tokenize
+from metrics import REGISTRY
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+SNIPPET_CHARS = 240
+
+# Fields computed per hit rather than read from the record
+COMPUTED_FIELDS = {"score", "snippet"}
+
+SERIALIZE_SECONDS = REGISTRY.histogram("api_response_serialize_seconds", "Time spent rendering JSON responses")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed, compact stdlib JSON otherwise."""
+
+    def render(self, content):
+        start = time.perf_counter()
+        if orjson is not None:
+            body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        else:
+            body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        SERIALIZE_SECONDS.observe(time.perf_counter() - start)
+        return body
+
+
+def parse_fields(fields):
+    """`fields=id,title&fields=score` -> ["id", "title", "score"]; None keeps whole records."""
+    if not fields:
+        return None
+    return [name.strip() for value in fields for name in value.split(",") if name.strip()]
+
+
+def make_snippet(record, query, size=SNIPPET_CHARS):
+    """A window of the content around the first query token, or its beginning."""
+    content = record.get("content", "")
+    folded = fold_text(content)
+
+    start = -1
+    for token in tokenize(query):
+        start = folded.find(token)
+        if start != -1:
+            break
+
+    # fold_text keeps one char per accented letter, so offsets line up with the original text
+    # (except for rare compatibility characters like ligatures)
+    begin = max(0, start - size // 3) if start != -1 else 0
+    snippet = content[begin:begin + size].strip()
+    return ("…" if begin > 0 else "") + snippet + ("…" if begin + size < len(content) else "")
+
+
+def project(record, fields, query=None, score=None):
+    """Keeps only the requested fields of a record, computing score and snippet if asked."""
+    if fields is None:
+        return record
+
+    projected = {}
+    for field in fields:
+        if field == "score":
+            projected["score"] = score
+        elif field == "snippet":
+            projected["snippet"] = make_snippet(record, query or "")
+        elif field in record:
+            projected[field] = record[field]
+    return projected
+
+
+def encode_cursor(generation, offset):
+    raw = json.dumps({"g": generation, "o": offset}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (generation, offset); raises ValueError, KeyError or TypeError on a malformed cursor."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    return int(data["g"]), int(data["o"])
@@ -1,19 +1,228 @@
+import argparse
 import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import faiss
+import numpy as np
 
-def search_incidents(query):
-    """Simple keyword search in incident titles and descriptions."""
-    with open("normalized_incidents.json", "r", encoding="utf-8") as f:
-        incidents = json.load(f)
+# This script loads the model and the snapshot itself, once; importing api must not
+os.environ.setdefault("API_LAZY_START", "1")
+import api  # noqa: E402
+from facets import SearchFilters  # noqa: E402
+from query_cache import normalize_query  # noqa: E402
+from response_format import parse_fields, project  # noqa: E402
 
-    results = [
-        inc for inc in incidents
-        if query.lower() in inc["title"].lower() or query.lower() in inc.get("Descripción del problema", "").lower()
-    ]
+# Queries read, encoded and searched per round; a round's results are written before the next is read
+BATCH_SIZE = 1024
+# Texts per model.encode forward pass
+ENCODE_BATCH_SIZE = 128
+DEFAULT_FIELDS = "id,title,score,snippet"
 
-    return results
 
-if __name__ == "__main__":
+def read_queries(stream):
+    """Queries from JSONL lines: {"query": ..., "id": ..., filters...}, a JSON string, or plain text."""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            item = line
+        yield item if isinstance(item, dict) else {"query": str(item)}
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def line_values(value):
+    """A filter given as one string or a list of them, as a tuple."""
+    if not value:
+        return ()
+    return (value,) if isinstance(value, str) else tuple(value)
+
+
+def line_date(value):
+    """YYYY-MM-DD as the facet index compares it; raises ValueError if malformed."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def query_filters(item):
+    """Facet filters of one query line, named like the /search parameters."""
+    return SearchFilters(
+        line_date(item.get("date_from")), line_date(item.get("date_to")), line_values(item.get("country")),
+        line_values(item.get("status")), line_values(item.get("has_section")),
+    )
+
+
+def line_num_results(item, default):
+    """The line's num_results (an int or a numeric string); raises ValueError unless it is at least 1."""
+    value = item.get("num_results", default)
+    num_results = int(value) if isinstance(value, str) and value.strip().isdigit() else value
+    if isinstance(num_results, bool) or not isinstance(num_results, int) or num_results < 1:
+        raise ValueError(f"num_results must be a positive integer, got {value!r}")
+    return num_results
+
+
+def search_corpus(corpus, rows, queries, vectors, num_results, filters_by_row, nprobe=None, ef_search=None):
+    """Ranked (position, score) hits of every row for one corpus, one index.search per distinct filter.
+
+    The group is searched with the largest k any of its rows needs; each row
+    then only ranks as many candidates as its own num_results asks for.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(filters_by_row[row], []).append(row)
+
+    hits = {}
+    for filters, group in groups.items():
+        allowed = corpus.allowed_positions(filters)
+        if allowed is not None and not allowed:
+            hits.update((row, []) for row in group)
+            continue
+
+        row_k = {row: corpus.candidates_k(corpus.search_k(num_results[row])) for row in group}
+        # FAISS spreads a multi-query search over its OpenMP threads
+        _, idx = corpus.index.search(
+            vectors[group], max(row_k.values()), params=corpus.search_params(nprobe, ef_search, filters)
+        )
+        for row, faiss_hits in zip(group, idx):
+            hits[row] = api.rank_candidates(
+                queries[row], corpus, vectors[row:row + 1], faiss_hits[:row_k[row]], num_results[row], allowed
+            )
+    return hits
+
+
+def search_batch(snap, model, items, categories, num_results=100, fields=None, nprobe=None, ef_search=None,
+                 pool=None):
+    """One output dict per query item, in order: {"id", "query", "results": {corpus: [records]}}."""
+    outputs = [{"id": item["id"]} if "id" in item else {} for item in items]
+    queries = [normalize_query(str(item.get("query", ""))) for item in items]
+
+    limits = [None] * len(items)
+    filters = [None] * len(items)
+    rows_by_corpus = {name: [] for name in categories}
+    for row, (item, output) in enumerate(zip(items, outputs)):
+        output["query"] = item.get("query", "")
+        try:
+            wanted = line_values(item.get("categories")) or categories
+            limits[row] = line_num_results(item, num_results)
+            filters[row] = query_filters(item)
+        except (ValueError, TypeError) as e:
+            # A bad line gets its own error; the rest of the batch is still searched
+            output["error"] = str(e)
+            continue
+        unknown = [c for c in wanted if c not in snap.corpora]
+        if unknown or not queries[row]:
+            output["error"] = f"Unknown categories: {', '.join(unknown)}" if unknown else "Empty query"
+            continue
+        output["results"] = {}
+        for name in wanted:
+            rows_by_corpus.setdefault(name, []).append(row)
+
+    searched = [row for row, output in enumerate(outputs) if "results" in output]
+    if not searched:
+        return outputs
+
+    # One encode call for the whole batch; the model runs on every core
+    encoded = model.encode([queries[row] for row in searched], batch_size=ENCODE_BATCH_SIZE).astype("float32")
+    vectors = np.zeros((len(items), encoded.shape[1]), dtype="float32")
+    vectors[searched] = encoded
+
+    futures = {
+        name: pool.submit(
+            search_corpus, snap.corpora[name], rows, queries, vectors, limits, filters, nprobe, ef_search
+        )
+        for name, rows in rows_by_corpus.items() if rows
+    }
+    for name, future in futures.items():
+        data = snap.corpora[name].data
+        for row, hits in future.result().items():
+            outputs[row]["results"][name] = [project(data[i], fields, queries[row], score) for i, score in hits]
+
+    return outputs
+
+
+def run_bulk(snap, model, stream, out, categories, batch_size=BATCH_SIZE, **options):
+    """Streams JSONL results for JSONL queries, one batch at a time."""
+    start = time.perf_counter()
+    count = 0
+    # The corpora of a batch are searched in parallel; FAISS releases the GIL while searching
+    with ThreadPoolExecutor(max_workers=len(snap.corpora)) as pool:
+        for batch in batches(read_queries(stream), batch_size):
+            for output in search_batch(snap, model, batch, categories, pool=pool, **options):
+                out.write(json.dumps(output, ensure_ascii=False) + "\n")
+            out.flush()
+            count += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"🔍 {count} queries in {elapsed:.1f}s ({count / elapsed:.1f} queries/s)", file=sys.stderr)
+
+
+def interactive(snap, model):
+    """The old prompt: one query, matching incidents with the start of their description."""
     query = input("Enter search query: ")
-    results = search_incidents(query)
-    for r in results:
-        print(f"\n🔍 {r['title']}: {r.get('Descripción del problema', 'No description')[:200]}...")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        output = search_batch(snap, model, [{"query": query}], ["incidents"], pool=pool)[0]
+    for r in output.get("results", {}).get("incidents", []):
+        # The normalizer lowercases section names
+        print(f"\n🔍 {r['title']}: {r.get('descripción del problema', 'No description')[:200]}...")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bulk search: JSONL queries in, ranked JSONL results out, with the API's indexes and ranking."
+    )
+    parser.add_argument("input", nargs="?", default="-", help="JSONL file of queries, '-' for stdin (default)")
+    parser.add_argument("--output", default="-", help="JSONL results file, '-' for stdout (default)")
+    parser.add_argument("--categories", default="",
+                        help="Comma-separated corpora searched when a query line doesn't list its own "
+                             "(default: every loaded corpus)")
+    parser.add_argument("--num-results", type=int, default=100, help="Hits per corpus (per-line 'num_results')")
+    parser.add_argument("--fields", default=DEFAULT_FIELDS, help="Fields per hit, '' for whole records")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Queries encoded and searched at once")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="FAISS search threads")
+    parser.add_argument("--nprobe", type=int, help="IVF lists to probe (IVF indexes only)")
+    parser.add_argument("--ef-search", type=int, help="HNSW search depth (HNSW indexes only)")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    # The same model and snapshot (prebuilt file or individual files) the API serves
+    api.load_resources()
+
+    if args.input == "-" and sys.stdin.isatty():
+        interactive(api.snapshot, api.model)
+        sys.exit(0)
+
+    options = {
+        "num_results": args.num_results,
+        "fields": parse_fields([args.fields]),
+        "nprobe": args.nprobe,
+        "ef_search": args.ef_search,
+    }
+    categories = [c.strip() for c in args.categories.split(",") if c.strip()] or list(api.snapshot.corpora)
+
+    stream = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run_bulk(api.snapshot, api.model, stream, out, categories, args.batch_size, **options)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if out is not sys.stdout:
+            out.close()
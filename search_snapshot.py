@@ -0,0 +1,211 @@
+import glob
+import json
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import numpy as np
+from facets import FacetIndex
+from index_meta import load_index_meta
+from lexical_index import LexicalIndex, lexical_index_path
+from record_store import compact_records, light_record, record_lookups
+
+# name -> (faiss file, normalized JSON file) for every corpus served by the API.
+# postmortem_index.faiss is built from normalized_postmortem.json, so serve the same file
+CORPUS_FILES = {
+    "incidents": ("incident_index.faiss", "normalized_incidents.json"),
+    "solicitudes": ("solicitudes_index.faiss", "normalized_solicitudes.json"),
+    "causaraiz": ("causaraiz_index.faiss", "normalized_causaraiz.json"),
+    "postmortem": ("postmortem_index.faiss", "normalized_postmortem.json"),
+}
+
+SNAPSHOT_FILE = "search_snapshot.bin"
+
+# 03: indexes live in their own files next to the snapshot, lexical postings are packed arrays
+MAGIC = b"AKSNAP03"
+# Footer: generation, header offset and header length, little-endian uint64
+FOOTER = struct.Struct("<QQQ")
+# Blobs start on this boundary so the int64 offsets arrays can be viewed in place
+ALIGNMENT = 64
+
+
+class SnapshotWriter:
+    """Appends raw blobs to a snapshot file and remembers where they went."""
+
+    def __init__(self, f):
+        self.f = f
+        self.f.write(MAGIC)
+
+    def blob(self, data):
+        padding = -self.f.tell() % ALIGNMENT
+        self.f.write(b"\0" * padding)
+        offset = self.f.tell()
+        self.f.write(data)
+        return offset, len(data)
+
+    def records(self, records):
+        """Writes the compact records back to back; returns (offset, offsets array)."""
+        self.f.write(b"\0" * (-self.f.tell() % ALIGNMENT))
+        base = self.f.tell()
+        offsets = np.zeros(len(records) + 1, dtype="int64")
+        for i, encoded in enumerate(compact_records(records)):
+            self.f.write(encoded)
+            offsets[i + 1] = self.f.tell() - base
+        return base, offsets
+
+    def finish(self, generation, header):
+        data = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self.f.tell()
+        self.f.write(data)
+        self.f.write(FOOTER.pack(generation, offset, len(data)))
+
+
+def available_corpora(corpus_files=CORPUS_FILES):
+    """The corpora whose index and records are on disk; an empty source leaves no index to serve."""
+    available = {}
+    for name, (faiss_path, json_path) in corpus_files.items():
+        if os.path.exists(faiss_path) and os.path.exists(json_path):
+            available[name] = (faiss_path, json_path)
+        else:
+            print(f"⚠️ Warning: {faiss_path} or {json_path} not found, skipping the {name} corpus.")
+    return available
+
+
+def snapshot_index_path(path, generation, name):
+    """search_snapshot.bin -> search_snapshot.bin.<generation>.<corpus>.faiss"""
+    return f"{path}.{generation}.{name}.faiss"
+
+
+def link_index(faiss_path, index_path):
+    """Puts the index of a snapshot in place, as a hard link when possible.
+
+    .faiss files are only ever replaced, never rewritten, so a link keeps the
+    exact index the snapshot was built from.
+    """
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(faiss_path, tmp_path)
+    except OSError:
+        shutil.copyfile(faiss_path, tmp_path)
+    os.replace(tmp_path, index_path)
+
+
+def remove_old_indexes(path, generation):
+    """Deletes the index files of snapshots before the previous one.
+
+    The previous generation's are kept for workers that are still loading it;
+    workers that mapped older ones keep their pages until they reload.
+    """
+    for index_path in glob.glob(glob.escape(path) + ".*.*.faiss"):
+        try:
+            file_generation = int(index_path[len(path) + 1:].split(".", 1)[0])
+        except ValueError:
+            continue
+        if file_generation < generation - 1:
+            os.remove(index_path)
+
+
+def snapshot_corpus(writer, faiss_path, json_path, index_path):
+    """Writes the blobs of one corpus and returns its header entry.
+
+    The index goes to its own file, so the API can mmap it (FAISS_MMAP) and
+    forked workers share its pages after a reload too.
+    """
+    link_index(faiss_path, index_path)
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    records_base, offsets = writer.records(records)
+    offsets_blob = writer.blob(offsets.tobytes())
+
+    meta = load_index_meta(faiss_path)
+    id_mapped = meta is not None
+    light = [light_record(record) for record in records]
+    faiss_to_pos, by_page_id, by_incident_number = record_lookups(light, id_mapped)
+
+    lexical = None
+    if os.path.exists(lexical_index_path(faiss_path)):
+        index = LexicalIndex.load(lexical_index_path(faiss_path))
+        if index.num_docs == len(records):
+            # Unpickling millions of [doc_id, tf] lists is slower than parsing the JSON; arrays are views
+            rows, *arrays = index.pack()
+            lexical = {"rows": rows, **{
+                name: writer.blob(array.tobytes())
+                for name, array in zip(("offsets", "doc_ids", "tfs", "doc_lengths"), arrays)
+            }}
+
+    return {
+        "index_file": os.path.basename(index_path),
+        "records": records_base,
+        "offsets": offsets_blob,
+        "num_records": len(records),
+        "index_config": meta.get("index") if meta else None,
+        "passage_counts": {int(page_id): n for page_id, n in meta.get("passages", {}).items()} if meta else None,
+        "light": light,
+        "faiss_to_pos": faiss_to_pos,
+        "by_page_id": by_page_id,
+        "by_incident_number": by_incident_number,
+        "lexical": lexical,
+        "facets": FacetIndex.load(json_path, by_page_id),
+    }
+
+
+def write_search_snapshot(generation, path=SNAPSHOT_FILE, corpus_files=CORPUS_FILES):
+    """Bundles every corpus (index, records, lookups, lexical and facet indexes) into one file.
+
+    The API loads it with one mmap and a small unpickle instead of parsing the
+    JSON files and rebuilding the lookups. It is only used while `generation`
+    is the current index generation.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        writer = SnapshotWriter(f)
+        corpora = {
+            name: snapshot_corpus(writer, faiss_path, json_path, snapshot_index_path(path, generation, name))
+            for name, (faiss_path, json_path) in available_corpora(corpus_files).items()
+        }
+        writer.finish(generation, corpora)
+    os.replace(tmp_path, path)
+    remove_old_indexes(path, generation)
+    print(f"✅ Search snapshot for generation {generation} saved as '{path}'")
+
+
+class SearchSnapshotFile:
+    """A mapped snapshot file; blobs are views into the mapping, not copies.
+
+    The header is a pickle, so only load files written by vectorize_data.py.
+    """
+
+    def __init__(self, path=SNAPSHOT_FILE):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a search snapshot")
+
+        self.generation, offset, length = FOOTER.unpack(self.mm[-FOOTER.size:])
+        self.corpora = pickle.loads(self.mm[offset:offset + length])
+
+    def index_path(self, part):
+        """Path of a corpus's index file, next to the snapshot file."""
+        return os.path.join(os.path.dirname(self.path), part["index_file"])
+
+    def blob(self, location, dtype="uint8"):
+        offset, length = location
+        return np.frombuffer(self.mm, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+
+def snapshot_generation(path=SNAPSHOT_FILE):
+    """Generation a snapshot file was written for, or None if there is no readable one."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            f.seek(-FOOTER.size, os.SEEK_END)
+            return FOOTER.unpack(f.read(FOOTER.size))[0]
+    except (OSError, struct.error):
+        return None
@@ -0,0 +1,104 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+import uvicorn
+from memory_stats import format_memory, process_memory
+
+# Load the model, indexes and records once in the parent so forked workers share them.
+# FAISS_MMAP makes the indexes file-backed too, so their pages come from the page cache.
+os.environ.setdefault("FAISS_MMAP", "1")
+import api  # noqa: E402
+
+
+def run_worker(sock, threads):
+    """Runs one uvicorn server on the inherited listening socket."""
+    import faiss
+    import torch
+
+    # Split the cores between workers instead of every worker using all of them
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+
+    config = uvicorn.Config(api.app, log_level=os.getenv("LOG_LEVEL", "info"))
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(sock, threads):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def report_memory(workers, interval):
+    while True:
+        time.sleep(interval)
+        print("📊 Memory per worker:")
+        for pid in list(workers):
+            print("   " + format_memory(pid, process_memory(pid)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve api.py with N pre-forked workers sharing indexes and model.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-report", type=float, default=0, help="Seconds between memory reports (0 = off)")
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    # Move everything loaded so far out of the GC's reach so collections in the
+    # workers don't touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    workers = set()
+    for _ in range(args.workers):
+        workers.add(spawn_worker(sock, threads))
+    print(f"✅ Serving on http://{args.host}:{args.port} with {args.workers} workers ({threads} threads each)")
+
+    if args.memory_report > 0:
+        threading.Thread(target=report_memory, args=(workers, args.memory_report), daemon=True).start()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: replace workers that die until we are asked to stop
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"⚠️ Worker {pid} exited with status {status}, restarting it")
+            workers.add(spawn_worker(sock, threads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import re
+from html.parser import HTMLParser
+from normalize_data import FIELD_PATTERNS, CODE_KEYWORDS
+
+# Lowercased field name -> itself, for matching heading / bold labels
+FIELD_LOOKUP = {pattern.lower(): pattern.lower() for pattern in FIELD_PATTERNS}
+
+# Field names are matched lowercased; some CODE_KEYWORDS entries aren't ("sentencia SQL")
+CODE_FIELDS = frozenset(keyword.lower() for keyword in CODE_KEYWORDS)
+
+# Where a code block goes when it doesn't sit under a code field
+DEFAULT_CODE_FIELD = "código proporcionado"
+
+LABEL_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6", "strong", "b"}
+BLOCK_TAGS = {"p", "br", "li", "tr", "div", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre"}
+LABEL_STRIP_RE = re.compile(r"[\s:]+$")
+SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_label(text):
+    return SPACES_RE.sub(" ", LABEL_STRIP_RE.sub("", text.strip())).lower()
+
+
+class StorageParser(HTMLParser):
+    """Single streaming pass over Confluence storage XHTML.
+
+    Collects the plain text of the page (the same strings BeautifulSoup's
+    get_text() returns) and, at the same time, the sections introduced by
+    headings or bold labels that name a known field. Code macros are kept
+    verbatim, newlines included.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text_parts = []
+        self.sections = {}
+        self.current_field = None
+        self.label_depth = 0
+        self.label_parts = []
+        self.in_code_macro = False
+        # Nesting of the open macros, and the field to go back to when the code macro closes
+        self.macro_stack = []
+        self.field_before_code = None
+        self.in_code_body = False
+        self.in_macro_parameter = False
+
+    def _section_append(self, text):
+        if self.current_field is not None:
+            self.sections.setdefault(self.current_field, []).append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "ac:structured-macro":
+            is_code = dict(attrs).get("ac:name") in ("code", "noformat") and not self.in_code_macro
+            self.macro_stack.append(is_code)
+            if is_code:
+                self.in_code_macro = True
+                self.field_before_code = self.current_field
+        elif tag == "ac:plain-text-body" and self.in_code_macro:
+            self.in_code_body = True
+        elif tag == "ac:parameter":
+            self.in_macro_parameter = True
+        elif tag in LABEL_TAGS:
+            if self.label_depth == 0:
+                self.label_parts = []
+            self.label_depth += 1
+
+        if tag in BLOCK_TAGS:
+            self._section_append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._section_append("\n")
+
+    def handle_endtag(self, tag):
+        if tag == "ac:plain-text-body":
+            self.in_code_body = False
+        elif tag == "ac:parameter":
+            self.in_macro_parameter = False
+        elif tag == "ac:structured-macro" and self.macro_stack:
+            if self.macro_stack.pop():
+                # A label inside the macro (its title, say) doesn't start a section after it
+                self.in_code_macro = False
+                self.current_field = self.field_before_code
+        elif tag in LABEL_TAGS and self.label_depth:
+            self.label_depth -= 1
+            if self.label_depth == 0:
+                self._close_label()
+
+        if tag in BLOCK_TAGS:
+            self._section_append("\n")
+
+    def _close_label(self):
+        label = "".join(self.label_parts)
+        field = FIELD_LOOKUP.get(normalize_label(label))
+        if field:
+            self.current_field = field
+        else:
+            # Bold text that isn't a field label is ordinary content
+            self._section_append(label)
+
+    def handle_data(self, data):
+        self.text_parts.append(data)
+        if self.in_macro_parameter:
+            # Macro settings like language=sql are in get_text() but aren't content
+            return
+        if self.in_code_body:
+            self._add_code(data)
+        elif self.label_depth:
+            self.label_parts.append(data)
+        else:
+            self._section_append(data)
+
+    def _add_code(self, code):
+        field = self.current_field if self.current_field in CODE_FIELDS else DEFAULT_CODE_FIELD
+        self.sections.setdefault(field, []).append(code if not self.sections.get(field) else "\n" + code)
+
+    def _cdata(self, data):
+        self.text_parts.append(data)
+        if self.in_code_body:
+            self._add_code(data)
+        else:
+            self._section_append(data)
+
+    def unknown_decl(self, data):
+        if data.startswith("CDATA["):
+            self._cdata(data[len("CDATA["):])
+
+    def handle_comment(self, data):
+        # Newer Pythons report CDATA outside SVG/MathML as a bogus comment
+        if data.startswith("[CDATA[") and data.endswith("]]"):
+            self._cdata(data[len("[CDATA["):-2])
+
+
+def parse_storage(html):
+    """Returns (plain text, {field name: raw section text}) for a storage-format page."""
+    parser = StorageParser()
+    parser.feed(html)
+    parser.close()
+
+    sections = {}
+    for field, parts in parser.sections.items():
+        value = "".join(parts).strip()
+        if value:
+            sections[field] = value
+
+    return "".join(parser.text_parts), sections
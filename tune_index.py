@@ -0,0 +1,168 @@
+import argparse
+import json
+import time
+import numpy as np
+import faiss
+from embedding_cache import EmbeddingCache
+from exact_vectors import ExactVectors, exact_vectors_count
+from index_factory import build_index, make_search_params, resolve_config
+from index_meta import load_index_meta
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Configurations tried by default; each one is swept over its search-time parameter
+DEFAULT_CONFIGS = [
+    {"type": "flat"},
+    {"type": "hnsw", "M": 16},
+    {"type": "hnsw", "M": 32},
+    {"type": "ivf_flat", "nlist": 256},
+    {"type": "ivf_pq", "nlist": 256, "m": 48},
+    {"type": "ivf_pq", "nlist": 256, "m": 48, "rerank": 4},
+    {"type": "sq8"},
+    {"type": "sq8", "rerank": 4},
+]
+NPROBE_SWEEP = [1, 4, 8, 16, 32, 64]
+EF_SEARCH_SWEEP = [16, 32, 64, 128, 256]
+
+
+def load_vectors(faiss_path):
+    """Loads the exact vectors of an index and their FAISS ids.
+
+    They come from the rerank side file if there is one, else from the
+    embedding cache, else (flat indexes only) from the index itself.
+    """
+    meta = load_index_meta(faiss_path)
+    if not meta:
+        # Indexes from before the meta sidecar are plain flat indexes keyed by position
+        index = faiss.read_index(faiss_path)
+        if not isinstance(index, faiss.IndexFlat):
+            raise SystemExit(f"❌ {faiss_path} has no meta sidecar; run vectorize_data.py first.")
+        return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype="int64")
+
+    if exact_vectors_count(faiss_path) is not None:
+        exact = ExactVectors.load(faiss_path)
+        return np.array(exact.vectors[exact.order]), exact.sorted_ids
+
+    if "passages" in meta:
+        # The cache is keyed by passage text, which the meta doesn't keep; read the vectors back instead
+        index = faiss.read_index(faiss_path)
+        base = faiss.downcast_index(index.index)
+        if not isinstance(base, faiss.IndexFlat):
+            raise SystemExit(f"❌ {faiss_path} is chunked and not flat; rebuild it as flat to tune it.")
+        return base.reconstruct_n(0, base.ntotal), faiss.vector_to_array(index.id_map).astype("int64")
+
+    found = EmbeddingCache().get_many(meta.get("model", MODEL_NAME), meta["ids"].values())
+    ids = [int(page_id) for page_id, h in meta["ids"].items() if h in found]
+    vectors = np.stack([found[meta["ids"][str(page_id)]] for page_id in ids]).astype("float32")
+    return vectors, np.array(ids, dtype="int64")
+
+
+def recall_at_k(truth, found, k):
+    hits = sum(len(set(t[:k]) & set(f[:k]) - {-1}) for t, f in zip(truth, found))
+    # Corpora smaller than k have fewer than k true neighbours
+    return hits / sum(len(set(t[:k]) - {-1}) for t in truth)
+
+
+def measure(index, queries, k, params=None, repeat=3, exact=None, rerank=None):
+    """Returns (ids, queries per second) searching one query at a time, like the API does.
+
+    With `exact` vectors and a `rerank` factor, k * rerank candidates are
+    fetched and reordered by exact distance, as api.rank_faiss does.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if exact is not None and rerank:
+            results = [exact.rerank(q, index.search(q[None, :], k * rerank, params=params)[1][0], k) for q in queries]
+        else:
+            results = [index.search(q[None, :], k, params=params)[1][0] for q in queries]
+        best = min(best, time.perf_counter() - start)
+    return np.array(results), len(queries) / best
+
+
+def built_params(index):
+    """nlist / nbits an IVF index was actually built with; build_index shrinks them on small corpora."""
+    ivf = faiss.try_extract_index_ivf(faiss.downcast_index(index.index))
+    if ivf is None:
+        return {}
+    ivf = faiss.downcast_index(ivf)
+    built = {"nlist": ivf.nlist}
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        built["nbits"] = ivf.pq.nbits
+    return built
+
+
+def tune(faiss_path, configs, k=10, num_queries=500, seed=0):
+    vectors, ids = load_vectors(faiss_path)
+    dim = vectors.shape[1]
+
+    # Queries are corpus vectors with a little noise, so they land where real queries do
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(0, 0.01, size=(len(sample), dim)).astype("float32")
+
+    exact = build_index({"type": "flat"}, dim, vectors, ids)
+    truth, _ = measure(exact, queries, k, repeat=1)
+    flat_bytes = int(faiss.serialize_index(exact).size)
+    exact_vectors = ExactVectors(vectors, ids)
+
+    report = []
+    for config in configs:
+        config = resolve_config(config)
+        start = time.perf_counter()
+        index = build_index(config, dim, vectors, ids)
+        build_seconds = time.perf_counter() - start
+        built = built_params(index)
+
+        if config["type"] == "hnsw":
+            sweep = [("ef_search", value) for value in EF_SEARCH_SWEEP]
+        elif config["type"].startswith("ivf"):
+            sweep = [("nprobe", value) for value in NPROBE_SWEEP]
+        else:
+            sweep = [(None, None)]
+
+        for param, value in sweep:
+            params = make_search_params(config, **({param: value} if param else {}))
+            found, qps = measure(index, queries, k, params, exact=exact_vectors, rerank=config.get("rerank"))
+            index_bytes = int(faiss.serialize_index(index).size)
+            row = {
+                "config": config,
+                "built": built,
+                "param": param,
+                "value": value,
+                f"recall@{k}": round(recall_at_k(truth, found, k), 4),
+                "qps": round(qps, 1),
+                "build_seconds": round(build_seconds, 3),
+                # What each API worker holds in memory, and how much less than the flat index that is
+                "index_bytes": index_bytes,
+                "memory_saved": round(1 - index_bytes / flat_bytes, 4),
+                # The rerank side file is mmap'd, so it is shared by the workers through the page cache
+                "exact_bytes": int(vectors.nbytes + ids.nbytes) if config.get("rerank") else 0,
+            }
+            report.append(row)
+            name = config["type"] + (f"+rerank{config['rerank']}" if config.get("rerank") else "")
+            built_text = " ".join(f"{key}={value}" for key, value in built.items())
+            print(f"{name:<16} {built_text:<18} {str(param or ''):<10} {str(value or ''):<5} "
+                  f"recall@{k}={row[f'recall@{k}']:.3f}  qps={row['qps']:>9.1f}  bytes={row['index_bytes']} "
+                  f"({row['memory_saved']:.0%} saved)")
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall@k vs the exact index and QPS per index configuration.")
+    parser.add_argument("faiss_file", help="Index built by vectorize_data.py, e.g. incident_index.faiss")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--configs", help="JSON list of index configs (default: a built-in grid)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    configs = json.loads(args.configs) if args.configs else DEFAULT_CONFIGS
+    print(f"🔍 Tuning {args.faiss_file} (k={args.k}, {args.queries} queries)")
+    report = tune(args.faiss_file, configs, k=args.k, num_queries=args.queries)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"✅ Report saved to {args.output}")
@@ -1,38 +1,303 @@
+import argparse
+import hashlib
+import json
 import os
+import sys
+import threading
 import time
 import subprocess
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import requests
+import extract_confluence
+import normalize_data
+import vectorize_data
+from exact_vectors import exact_vectors_paths
+from facets import facets_path
+from generation import bump_generation, read_generation
+from index_meta import index_meta_path
+from lexical_index import build_lexical_index, lexical_index_path
+from record_store import convert_json_to_record_store, record_store_paths
+from related_graph import RELATED_GRAPH_FILE, RELATED_GRAPH_META_FILE, RELATED_K, build_related_graph
+from search_snapshot import CORPUS_FILES, SNAPSHOT_FILE, write_search_snapshot
 
-EXTRACT_SCRIPT = "extract_confluence.py"
-NORMALIZE_SCRIPT = "normalize_data.py"
-VECTORIZING_SCRIPT = "vectorize_data.py"
-API_SCRIPT = "api.py"
+# Pre-forking server for api.py (api.py itself has no __main__)
+SERVE_SCRIPT = "serve.py"
 STREAMLIT_SCRIPT = "chatbot_ui.py"
+API_RELOAD_URL = os.getenv("API_RELOAD_URL", "http://127.0.0.1:8000/admin/reload")
 
-def run_script(script_name):
-    """Executes a Python script and waits for it to complete."""
-    print(f"🔄 Running {script_name}...")
-    result = subprocess.run(["python", script_name], capture_output=True, text=True)
-    
-    if result.returncode == 0:
-        print(f"✅ {script_name} completed successfully.")
-    else:
-        print(f"❌ Error in {script_name}:\n{result.stderr}")
-
-def restart_fastapi():
-    """Restarts the FastAPI server."""
-    print("🔄 Restarting FastAPI server...")
-    subprocess.run(["pkill", "-f", API_SCRIPT])
-    subprocess.Popen(["python", API_SCRIPT])
-    print("✅ FastAPI restarted.")
+# Fingerprint of the inputs each stage last ran successfully with
+PIPELINE_STATE_FILE = "pipeline_state.json"
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def reload_fastapi():
+    """Asks the running API to hot-reload the new indexes; starts it if it isn't running.
+
+    Raises RuntimeError if the API answers but doesn't reload, so the publish
+    stage isn't recorded as done and runs again next time.
+    """
+    print("🔄 Reloading FastAPI indexes...")
+    try:
+        headers = {"X-Admin-Token": os.getenv("ADMIN_TOKEN", "")}
+        response = requests.post(API_RELOAD_URL, headers=headers, timeout=300)
+        if response.status_code == 200:
+            print(f"✅ FastAPI now serving generation {response.json().get('generation')}.")
+            return
+        raise RuntimeError(f"Reload failed: {response.status_code} - {response.text}")
+    except requests.exceptions.ConnectionError:
+        print(f"⚠️ FastAPI is not running at {API_RELOAD_URL}, starting {SERVE_SCRIPT}...")
+        # A new server loads the current generation on startup; it keeps running after the pipeline exits
+        subprocess.Popen([sys.executable, os.path.join(CODE_DIR, SERVE_SCRIPT)], cwd=os.getcwd(), start_new_session=True)
+        print(f"✅ {SERVE_SCRIPT} started.")
+
+class Stage:
+    """One step of the pipeline DAG.
+
+    A stage is skipped when its fingerprint (the contents of its input files, the
+    source files of the code it runs and its parameters) matches the last
+    successful run and its outputs still exist. `always` stages (the Confluence
+    sync, whose real input is remote) run every time.
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), after=(), code=(), params=None, always=False):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.code = [os.path.join(CODE_DIR, file_name) for file_name in code]
+        self.params = params
+        self.always = always
+
+class PipelineRunner:
+    """Runs stages as soon as their dependencies succeed; dependents of a failed stage never run."""
+
+    def __init__(self, stages, state_path=PIPELINE_STATE_FILE, force=False, workers=8):
+        # Stages must be listed after the stages they depend on
+        self.stages = stages
+        self.state_path = state_path
+        self.force = force
+        self.workers = workers
+        self.state = self.load_state()
+        self.state_lock = threading.Lock()
+        self.digests = {}
+        self.results = {}
+
+    def load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_state(self, name, fingerprint):
+        with self.state_lock:
+            self.state[name] = fingerprint
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=4)
+            os.replace(tmp_path, self.state_path)
+
+    def file_digest(self, path):
+        """sha256 of a file, memoized on (size, mtime) so shared inputs are hashed once per run."""
+        if not os.path.exists(path):
+            return "missing"
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self.digests:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            self.digests[key] = digest.hexdigest()
+        return self.digests[key]
+
+    def fingerprint(self, stage):
+        digest = hashlib.sha256(json.dumps(stage.params, sort_keys=True, default=str).encode("utf-8"))
+        for path in stage.code + stage.inputs:
+            digest.update(f"{path}={self.file_digest(path)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def execute(self, stage):
+        start = time.perf_counter()
+        fingerprint = self.fingerprint(stage)
+        up_to_date = (
+            not stage.always and not self.force
+            and self.state.get(stage.name) == fingerprint
+            and all(os.path.exists(path) for path in stage.outputs)
+        )
+        if up_to_date:
+            print(f"⏭️ {stage.name}: inputs unchanged, skipped")
+            return "skipped", time.perf_counter() - start
+
+        print(f"🔄 {stage.name}...")
+        try:
+            stage.run()
+        except Exception as e:
+            print(f"❌ {stage.name} failed: {e}")
+            return "failed", time.perf_counter() - start
+        self.save_state(stage.name, fingerprint)
+        return "ran", time.perf_counter() - start
+
+    def run(self):
+        """Runs the DAG; returns True when every stage ran or was skipped."""
+        pending = list(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for stage in list(pending):
+                    statuses = [self.results[name][0] if name in self.results else None for name in stage.after]
+                    if any(status in ("failed", "blocked") for status in statuses):
+                        pending.remove(stage)
+                        self.results[stage.name] = ("blocked", 0.0)
+                    elif all(status in ("ran", "skipped") for status in statuses):
+                        pending.remove(stage)
+                        running[pool.submit(self.execute, stage)] = stage
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self.results[running.pop(future).name] = future.result()
+
+        return all(status in ("ran", "skipped") for status, _ in self.results.values())
+
+    def print_summary(self, elapsed):
+        print("\n📊 Pipeline summary:")
+        for stage in self.stages:
+            status, seconds = self.results.get(stage.name, ("not run", 0.0))
+            print(f"   {stage.name:<32} {status:<8} {seconds:>8.1f}s")
+        print(f"   {'total':<32} {'':<8} {elapsed:>8.1f}s")
+
+def build_stages(full_sync=False, skip_extract=False, reload=True, executor=None, max_in_flight=8):
+    """extract → normalize → (vectorize, lexical, record store) per corpus → related graph → publish."""
+    # The model and the embedding cache are shared by every corpus; encoding one corpus
+    # at a time keeps all cores on one encode instead of oversubscribing them
+    encoder_lock = threading.Lock()
+
+    def vectorize(json_file, faiss_file):
+        with encoder_lock:
+            vectorize_data.create_vector_store(json_file, faiss_file)
+
+    stages = []
+    artifacts = []
+    corpus_stages = []
+    vectorize_stages = []
+    index_metas = []
+
+    normalized_by_input = {
+        input_file: (output_file, options) for input_file, output_file, options in normalize_data.DATASETS
+    }
+
+    for category, (_, prenorm_file) in extract_confluence.FOLDERS.items():
+        json_file, options = normalized_by_input[prenorm_file]
+        faiss_file = vectorize_data.DATASETS[json_file]
+        corpus = json_file.rsplit(".json", 1)[0].replace("normalized_", "")
+
+        extract = []
+        if not skip_extract:
+            stages.append(Stage(
+                f"extract:{corpus}", lambda category=category: extract_confluence.sync_category(category, full_sync),
+                outputs=[prenorm_file], always=True,
+            ))
+            extract = [f"extract:{corpus}"]
+
+        def normalize(prenorm_file=prenorm_file, json_file=json_file, options=options):
+            normalize_data.normalize_confluence_data(
+                prenorm_file, json_file, verbose=False, executor=executor, max_in_flight=max_in_flight, **options
+            )
+
+        stages.append(Stage(
+            f"normalize:{corpus}", normalize,
+            inputs=[prenorm_file], outputs=[json_file, facets_path(json_file)], after=extract,
+            code=["normalize_data.py", "facets.py", "lexical_index.py"], params=options,
+        ))
+
+        vectorize_outputs = [faiss_file, index_meta_path(faiss_file)]
+        if (vectorize_data.INDEX_CONFIG.get(faiss_file) or {}).get("rerank"):
+            vectorize_outputs.extend(exact_vectors_paths(faiss_file))
+
+        derived = [
+            Stage(
+                f"vectorize:{corpus}",
+                lambda json_file=json_file, faiss_file=faiss_file: vectorize(json_file, faiss_file),
+                inputs=[json_file], outputs=vectorize_outputs,
+                code=[
+                    "vectorize_data.py", "index_factory.py", "embedding_cache.py", "exact_vectors.py", "passages.py",
+                    "index_meta.py",
+                ],
+                params={"model": vectorize_data.MODEL_NAME, "index": vectorize_data.INDEX_CONFIG.get(faiss_file)},
+            ),
+            Stage(
+                f"lexical:{corpus}",
+                lambda json_file=json_file, faiss_file=faiss_file: build_lexical_index(
+                    json_file, lexical_index_path(faiss_file)
+                ),
+                inputs=[json_file], outputs=[lexical_index_path(faiss_file)], code=["lexical_index.py"],
+            ),
+            Stage(
+                f"record_store:{corpus}", lambda json_file=json_file: convert_json_to_record_store(json_file),
+                inputs=[json_file], outputs=list(record_store_paths(json_file)), code=["record_store.py"],
+            ),
+        ]
+        vectorize_stages.append(f"vectorize:{corpus}")
+        index_metas.append(index_meta_path(faiss_file))
+        for stage in derived:
+            stage.after = [f"normalize:{corpus}"]
+            artifacts.extend(stage.outputs)
+        stages.extend(derived)
+        corpus_stages.extend(stage.name for stage in derived)
+        artifacts.extend([json_file, facets_path(json_file)])
+
+    # The meta sidecars carry the content hashes the graph is updated from
+    related = Stage(
+        "related", lambda: build_related_graph(CORPUS_FILES, vectorize_data.MODEL_NAME),
+        inputs=index_metas, outputs=[RELATED_GRAPH_FILE, RELATED_GRAPH_META_FILE], after=vectorize_stages,
+        code=["related_graph.py", "passages.py", "index_meta.py", "embedding_cache.py"], params={"model": vectorize_data.MODEL_NAME, "k": RELATED_K},
+    )
+    stages.append(related)
+    artifacts.extend(related.outputs)
+    corpus_stages.append(related.name)
+
+    def publish():
+        # ✅ Readers only see the new indexes once every corpus is built
+        write_search_snapshot(read_generation() + 1)
+        bump_generation()
+        if reload:
+            reload_fastapi()
+
+    stages.append(Stage(
+        "publish", publish, inputs=artifacts, outputs=[SNAPSHOT_FILE], after=corpus_stages, code=["search_snapshot.py"],
+    ))
+    return stages
 
 def main():
-    """Executes the full data update pipeline."""
-    print("\n🚀 Starting full pipeline update...")
+    """Executes the data update pipeline in-process, skipping everything whose inputs didn't change."""
+    parser = argparse.ArgumentParser(description="Sync Confluence and rebuild the search indexes.")
+    parser.add_argument("--full", action="store_true", help="Re-crawl every page instead of a delta sync")
+    parser.add_argument("--skip-extract", action="store_true", help="Rebuild from the existing *_prenorm.json files")
+    parser.add_argument("--force", action="store_true", help="Run every stage even if its inputs didn't change")
+    parser.add_argument("--no-reload", action="store_true", help="Don't ask the running API to reload")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Normalization processes")
+    args = parser.parse_args()
+
+    print("\n🚀 Starting pipeline update...")
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        stages = build_stages(
+            full_sync=args.full, skip_extract=args.skip_extract, reload=not args.no_reload, executor=pool,
+            max_in_flight=args.workers * normalize_data.CHUNKS_IN_FLIGHT_PER_WORKER,
+        )
+        runner = PipelineRunner(stages, force=args.force)
+        ok = runner.run()
+
+    runner.print_summary(time.perf_counter() - start)
 
-    run_script(EXTRACT_SCRIPT)
-    run_script(NORMALIZE_SCRIPT)
-    run_script(VECTORIZING_SCRIPT)
-    restart_fastapi()
+    if not ok:
+        print("❌ Pipeline failed; the failed stages and everything after them run again on the next update.")
+        sys.exit(1)
 
     print("✅ Update complete! Changes are now reflected in the chatbot.")
 
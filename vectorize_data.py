@@ -1,53 +1,239 @@
-import json
+import os
+import threading
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
+from embedding_cache import EmbeddingCache, content_hash
+from generation import bump_generation, read_generation
+from exact_vectors import ExactVectorWriter, exact_vectors_count
+from index_factory import StreamingIndexBuilder, needs_training, resolve_config, supports_removal
+from index_meta import load_index_meta, save_index_meta
+from lexical_index import build_lexical_index, lexical_index_path
+from normalize_data import iter_json_array
+from passages import is_chunked, passage_ids, record_passages
+from record_store import convert_json_to_record_store
+from related_graph import build_related_graph
+from search_snapshot import CORPUS_FILES, write_search_snapshot
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
 
-def create_vector_store(input_file, output_faiss):
-    """Converts reports into numerical embeddings for search."""
+# Loaded on first use, so runs where every index is up to date never load it
+model = None
+model_lock = threading.Lock()
+embedding_cache = EmbeddingCache()
+
+# Index type per .faiss file: flat, hnsw, ivf_flat, ivf_pq or sq8 (see index_factory.INDEX_DEFAULTS).
+# Use tune_index.py to pick types and parameters from measured recall, QPS and memory.
+# "rerank": N keeps the exact vectors of a quantized index (sq8, ivf_pq) in an mmap'd side
+# file; the API then fetches N times the candidates and reorders them by exact distance.
+# "chunk_words" / "chunk_overlap" index long records as overlapping passages instead of
+# one vector each; MiniLM only reads the first ~256 word pieces (~160 words) of a text.
+INDEX_CONFIG = {
+    "incident_index.faiss": {"type": "flat"},
+    "solicitudes_index.faiss": {"type": "flat"},
+    "causaraiz_index.faiss": {"type": "flat"},
+    "postmortem_index.faiss": {"type": "flat", "chunk_words": 160, "chunk_overlap": 40},
+}
+
+# Passages per model.encode call and index add
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "256"))
+
+# normalized JSON file -> .faiss file built from it
+DATASETS = {
+    "normalized_incidents.json": "incident_index.faiss",
+    "normalized_solicitudes.json": "solicitudes_index.faiss",
+    "normalized_causaraiz.json": "causaraiz_index.faiss",
+    "normalized_postmortem.json": "postmortem_index.faiss"
+}
+
+# IVF centroids (and SQ8 ranges) are retrained once the corpus outgrows its training set by this factor
+IVF_RETRAIN_GROWTH = 4
+
+def load_model():
+    """The shared sentence encoder, loaded once per process."""
+    global model
+    with model_lock:
+        if model is None:
+            model = SentenceTransformer(MODEL_NAME)
+    return model
+
+def record_text(record):
+    """Text that gets embedded for a record."""
+    return record.get("cleaned_content", record.get("content", "")).strip()
+
+def record_page_id(record):
     try:
-        with open(input_file, "r", encoding="utf-8") as f:
-            records = json.load(f)
+        return int(record["id"])
+    except (KeyError, TypeError, ValueError):
+        return None
 
-        if not records:
+def create_vector_store(input_file, output_faiss, index_config=None):
+    """Converts reports into numerical embeddings for search.
+
+    The index is an IndexIDMap2 keyed by the Confluence page id, or by passage id
+    (see passages.py) when the config chunks long records into overlapping
+    passages. On re-runs only records whose content changed are removed and
+    re-added, and their embeddings come from the persistent embedding cache
+    whenever the text was seen before. Changing the index type or its parameters,
+    or removing vectors from an index that can't remove them (HNSW), rebuilds it
+    from cached embeddings.
+
+    Records are read twice as a stream (hashes first, then the texts to embed)
+    and passages go through the encoder in batches of ENCODE_BATCH_SIZE that
+    are added to the index right away, so memory doesn't grow with the corpus.
+    """
+    try:
+        config = resolve_config(index_config or INDEX_CONFIG.get(output_faiss))
+
+        # page id -> content hash for every record with content
+        wanted = {}
+        num_records = 0
+        for record in iter_json_array(input_file):
+            num_records += 1
+            text = record_text(record)
+            if not text:
+                continue
+            page_id = record_page_id(record)
+            if page_id is None:
+                print(f"⚠️ Warning: Record without numeric id in {input_file}. Skipping...")
+                continue
+            wanted[page_id] = content_hash(text)
+
+        if not num_records:
             print(f"⚠️ Warning: No data found in {input_file}. Skipping...")
             return
-        
-        text_list = [
-            record.get("cleaned_content", record.get("content", "")).strip() 
-            for record in records
-            if record.get("content") or record.get("cleaned_content")
-        ]
-
-        if not text_list:
+
+        if not wanted:
             print(f"⚠️ Warning: No valid content in {input_file}. Skipping...")
             return
 
-        embeddings = model.encode(text_list)
+        meta = load_index_meta(output_faiss)
+        index = None
+        indexed = {}
+        # page id -> number of passages in the index (chunked indexes only)
+        passage_counts = {}
+        trained_on = len(wanted)
+        if meta and meta.get("model") == MODEL_NAME and meta.get("index") == config and os.path.exists(output_faiss):
+            index = faiss.read_index(output_faiss)
+            indexed = {int(page_id): h for page_id, h in meta["ids"].items()}
+            passage_counts = {int(page_id): n for page_id, n in meta.get("passages", {}).items()}
+            trained_on = meta.get("trained_on", len(indexed))
+
+        to_remove = [page_id for page_id, h in indexed.items() if wanted.get(page_id) != h]
+        to_add = [page_id for page_id, h in wanted.items() if indexed.get(page_id) != h]
+
+        # A side file that doesn't match the index (e.g. a run died in between) can't be updated in place
+        exact_stale = (
+            bool(config.get("rerank")) and index is not None and exact_vectors_count(output_faiss) != index.ntotal
+        )
+
+        if index is not None and not to_remove and not to_add and not exact_stale:
+            print(f"✅ '{output_faiss}' is up to date ({len(wanted)} records)")
+            return
+
+        needs_rebuild = (
+            index is None
+            or exact_stale
+            or (to_remove and not supports_removal(config))
+            or (needs_training(config) and len(wanted) > IVF_RETRAIN_GROWTH * trained_on)
+        )
+
+        if needs_rebuild:
+            # Every vector is needed; unchanged texts come straight from the embedding cache
+            to_add = list(wanted)
+            to_remove = []
+            index = None
+            passage_counts = {}
+            trained_on = len(wanted)
+
+        removed_ids = []
+        if to_remove:
+            if is_chunked(config):
+                removed_ids = [i for page_id in to_remove for i in passage_ids(page_id, passage_counts.pop(page_id, 0))]
+            else:
+                removed_ids = to_remove
+            index.remove_ids(np.array(removed_ids, dtype="int64"))
+
+        encoder = load_model()
+        dim = encoder.get_sentence_embedding_dimension()
+        builder = StreamingIndexBuilder(config, dim, index)
+        exact = ExactVectorWriter(output_faiss, dim, removed_ids, needs_rebuild) if config.get("rerank") else None
 
-        print(f"🔍 Debug: {input_file} → Embeddings Shape: {embeddings.shape}")
+        batch_ids, batch_texts = [], []
+        num_passages = 0
 
-        embeddings = np.array(embeddings, dtype="float32").reshape(-1, embeddings.shape[-1])
+        def flush():
+            if batch_texts:
+                vectors = embedding_cache.encode(encoder, MODEL_NAME, batch_texts, verbose=False)
+                builder.add(vectors, np.array(batch_ids, dtype="int64"))
+                if exact is not None:
+                    exact.add(vectors, batch_ids)
+                batch_ids.clear()
+                batch_texts.clear()
 
-        index = faiss.IndexFlatL2(embeddings.shape[1])
-        index.add(embeddings)
+        pending = set(to_add)
+        for record in iter_json_array(input_file):
+            page_id = record_page_id(record)
+            if page_id not in pending:
+                continue
+            text = record_text(record)
+            # With duplicated ids, the version hashed above is the one indexed
+            if content_hash(text) != wanted[page_id]:
+                continue
+            pending.discard(page_id)
 
-        faiss.write_index(index, output_faiss)
+            passages = record_passages(page_id, text, config)
+            if is_chunked(config):
+                passage_counts[page_id] = len(passages)
+            for passage_id, passage in passages:
+                batch_ids.append(passage_id)
+                batch_texts.append(passage)
+                num_passages += 1
+                if len(batch_texts) >= ENCODE_BATCH_SIZE:
+                    flush()
+        flush()
+
+        if needs_rebuild:
+            print(f"🔧 Building {config['type']} index for {input_file}")
+        index = builder.finish()
+
+        print(f"🔍 Debug: {input_file} → {len(to_add)} records added as {num_passages} vectors, "
+              f"{len(to_remove)} removed, {index.ntotal} vectors in the index")
+
+        # Written aside and swapped in: API workers may have the old file mmap'd (FAISS_MMAP)
+        tmp_path = output_faiss + ".tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, output_faiss)
+        if exact is not None:
+            exact.finish()
+        new_meta = {
+            "model": MODEL_NAME,
+            "index": config,
+            "trained_on": trained_on,
+            "ids": {str(page_id): h for page_id, h in wanted.items()},
+        }
+        if is_chunked(config):
+            new_meta["passages"] = {str(page_id): n for page_id, n in passage_counts.items()}
+        save_index_meta(output_faiss, new_meta)
 
         print(f"✅ Vector store saved as '{output_faiss}'")
-    
+
     except Exception as e:
         print(f"❌ Error processing {input_file}: {str(e)}")
+        # A half-updated corpus must not be published as a new generation
+        raise
 
 if __name__ == "__main__":
-    datasets = {
-        "normalized_incidents.json": "incident_index.faiss",
-        "normalized_solicitudes.json": "solicitudes_index.faiss",
-        "normalized_causaraiz.json": "causaraiz_index.faiss",
-        "normalized_postmortem.json": "postmortem_index.faiss"
-    }
-
-    for json_file, faiss_file in datasets.items():
-        create_vector_store(json_file, faiss_file)
\ No newline at end of file
+    for json_file, faiss_file in DATASETS.items():
+        create_vector_store(json_file, faiss_file)
+        build_lexical_index(json_file, lexical_index_path(faiss_file))
+        convert_json_to_record_store(json_file)
+
+    # ✅ Related records within and across corpora, from the vectors just indexed
+    build_related_graph(CORPUS_FILES, MODEL_NAME)
+
+    # ✅ One prebuilt file for fast API startup, written before readers are told about it
+    write_search_snapshot(read_generation() + 1)
+
+    # ✅ Tell running readers (API caches) that the indexes changed
+    bump_generation()